@@ -0,0 +1,62 @@
+"""
+Key building and cache hits of the cache decorator, string keys against tuple_keys=True.
+
+    python -m benchmarks.cache_keys [CALLS]
+
+Both decorate the same (self, user_id) coroutine method, like a per user lookup on a cog.
+Before timing, both are checked to hit, invalidate and invalidate_containing the same
+entries.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import sys
+import time
+from typing import Any
+
+from utils.cache import cache
+
+USER_IDS = [80088516616269824 + i for i in range(10)]
+
+
+class Lookup:
+    @cache(maxsize=64)
+    async def string_keys(self, user_id: int) -> int:
+        return user_id
+
+    @cache(maxsize=64, tuple_keys=True)
+    async def tuple_keys(self, user_id: int) -> int:
+        return user_id
+
+
+def per_call(func: Any, calls: int) -> float:
+    start = time.perf_counter()
+    for i in range(calls):
+        func(USER_IDS[i % len(USER_IDS)])
+    return (time.perf_counter() - start) / calls
+
+
+async def main(calls: int) -> int:
+    lookup = Lookup()
+    same = True
+    for method in (lookup.string_keys, lookup.tuple_keys):
+        decorated = getattr(Lookup, method.__name__)
+        results = await asyncio.gather(*(method(user_id) for user_id in USER_IDS))
+        same = same and results == USER_IDS and len(decorated.cache) == len(USER_IDS)
+        same = same and method(USER_IDS[0]).done()  # served from the cache
+        same = same and decorated.invalidate(lookup, USER_IDS[0]) and len(decorated.cache) == len(USER_IDS) - 1
+        same = same and decorated.invalidate_containing(str(USER_IDS[1])) == 1
+        await asyncio.gather(*(method(user_id) for user_id in USER_IDS))
+    print(f'string and tuple keys behave the same: {same}')
+
+    for name in ('string_keys', 'tuple_keys'):
+        decorated = getattr(Lookup, name)
+        key = per_call(lambda user_id: decorated.get_key(lookup, user_id), calls)
+        hit = per_call(getattr(lookup, name), calls)
+        print(f'{name:>12}: key build {key * 1e9:6.0f}ns, cache hit {hit * 1e9:6.0f}ns')
+    return 0 if same else 1
+
+
+if __name__ == '__main__':
+    sys.exit(asyncio.run(main(int(sys.argv[1]) if len(sys.argv) > 1 else 200_000)))
@@ -0,0 +1,77 @@
+"""
+Membership checks on utils.cache.ExpiringCache against the implementation it replaced.
+
+    python -m benchmarks.expiring_cache
+
+The old cache scanned every entry for expired ones on each lookup, the current one
+only looks at the front of the insertion order. Both are filled with N live entries
+and then asked about a key in the middle, a short lived cache checks that they still
+expire the same keys.
+"""
+
+from __future__ import annotations
+
+import sys
+import time
+from typing import Any
+
+from utils.cache import ExpiringCache
+
+SIZES = (100, 10_000, 100_000)
+
+
+class LegacyExpiringCache(dict):
+    # utils.cache.ExpiringCache before the ordered rewrite
+    def __init__(self, seconds: float):
+        self.__ttl: float = seconds
+        super().__init__()
+
+    def __verify_cache_integrity(self):
+        current_time = time.monotonic()
+        to_remove = [k for (k, (v, t)) in super().items() if current_time > (t + self.__ttl)]
+        for k in to_remove:
+            del self[k]
+
+    def __contains__(self, key: Any):
+        self.__verify_cache_integrity()
+        return super().__contains__(key)
+
+    def __setitem__(self, key: Any, value: Any):
+        super().__setitem__(key, (value, time.monotonic()))
+
+
+def check_expiry() -> bool:
+    old, new = LegacyExpiringCache(0.05), ExpiringCache(0.05)
+    for key in range(10):
+        old[key] = new[key] = True
+    time.sleep(0.03)
+    for key in range(5, 15):
+        old[key] = new[key] = True
+    time.sleep(0.03)
+    return [key in old for key in range(15)] == [key in new for key in range(15)] == [False] * 5 + [True] * 10
+
+
+def lookup(cache: Any, key: int, number: int) -> float:
+    start = time.perf_counter()
+    for _ in range(number):
+        key in cache
+    return (time.perf_counter() - start) / number
+
+
+def main() -> int:
+    same = check_expiry()
+    print(f'expiry matches the old cache: {same}')
+    for size in SIZES:
+        old, new = LegacyExpiringCache(60), ExpiringCache(60)
+        for key in range(size):
+            old[key] = new[key] = True
+        number = max(20, 2_000_000 // size)
+        print(
+            f'{size:>7} entries: old {lookup(old, size // 2, number) * 1e6:9.2f}us, '
+            f'new {lookup(new, size // 2, 20_000) * 1e6:5.2f}us per membership check'
+        )
+    return 0 if same else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
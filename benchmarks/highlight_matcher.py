@@ -0,0 +1,90 @@
+"""
+Highlight matching per message, HighlightMatcher against the per user regex it replaced.
+
+    python -m benchmarks.highlight_matcher [MESSAGES]
+
+Each simulated user has 5 triggers picked from a random vocabulary with a few phrases and
+punctuated words mixed in, every message is 20 random words followed by some plurals and
+mixed case. Both implementations have to pick the same recipients for every message.
+"""
+
+from __future__ import annotations
+
+import random
+import re
+import string
+import sys
+import time
+from collections import defaultdict
+
+from cogs.highlight import HighlightMatcher
+
+USER_COUNTS = (10, 100, 1000)
+TRIGGERS_PER_USER = 5
+
+
+def create_user_regex(words: list[str]) -> re.Pattern:
+    # What Highlights.create_user_regex used to build, one pattern searched per subscriber
+    return re.compile(r'\b(' + '|'.join(map(re.escape, words)) + r')s?\b', re.IGNORECASE)
+
+
+def regex_search(patterns: dict[int, re.Pattern], content: str) -> dict[int, str]:
+    hits = {}
+    for user_id, pattern in patterns.items():
+        match = pattern.search(content)
+        if match is not None:
+            hits[user_id] = match.group(0)
+    return hits
+
+
+def per_message(func, messages: list[str], repeat: int = 3) -> float:
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for content in messages:
+            func(content)
+    return (time.perf_counter() - start) / (repeat * len(messages))
+
+
+def main(message_count: int) -> int:
+    rng = random.Random(1)
+    vocabulary = [''.join(rng.choices(string.ascii_lowercase, k=rng.randint(3, 8))) for _ in range(3000)]
+    vocabulary += ['apple pie', 'apple', 'c++', 'team', 'cat', 'cats', 'ß', 'straße', 'new york']
+    messages = [
+        ' '.join(rng.choices(vocabulary, k=20)) + ' Apples and cats, APPLE PIEs! c++ teams in New York'
+        for _ in range(message_count)
+    ]
+
+    failed = False
+    for user_count in USER_COUNTS:
+        triggers = {user_id: rng.sample(vocabulary, TRIGGERS_PER_USER) for user_id in range(user_count)}
+        patterns = {user_id: create_user_regex(words) for user_id, words in triggers.items()}
+        subscribers: defaultdict[str, set[int]] = defaultdict(set)
+        for user_id, words in triggers.items():
+            for word in words:
+                subscribers[word].add(user_id)
+        matcher = HighlightMatcher(subscribers)
+
+        mismatches = 0
+        for content in messages:
+            expected = regex_search(patterns, content)
+            found = matcher.search(content)
+            # Both start at the same place, the matcher prefers the longer trigger where the
+            # regex takes whichever alternative the user added first
+            if expected.keys() != found.keys() or any(
+                not (found[user_id].startswith(text) or text.startswith(found[user_id]))
+                for user_id, text in expected.items()
+            ):
+                mismatches += 1
+        failed = failed or bool(mismatches)
+
+        old = per_message(lambda content: regex_search(patterns, content), messages)
+        new = per_message(matcher.search, messages)
+        print(
+            f'{user_count:>5} users: regex loop {old * 1e6:8.1f}us, matcher {new * 1e6:6.1f}us per message, '
+            f'{mismatches} mismatches'
+        )
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(int(sys.argv[1]) if len(sys.argv) > 1 else 200))
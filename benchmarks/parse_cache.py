@@ -0,0 +1,80 @@
+"""
+utils.time.ParseCache against calling parsedatetime directly.
+
+    python -m benchmarks.parse_cache [NOWS]
+
+Common reminder phrases are parsed at NOWS random times of one day in Europe/Amsterdam,
+which defaults to the day the clocks go back. Every cached result is compared with what
+parsedatetime gives for the same phrase and time, for both the nlp and the parseDT path.
+Exits with status 1 on a mismatch.
+"""
+
+from __future__ import annotations
+
+import datetime
+import random
+import sys
+import time
+import zoneinfo
+
+from utils.time import HumanTime, ParseCache
+
+PHRASES = [
+    '5pm', 'in 3 days', 'tomorrow', 'next thursday', 'tomorrow at 6pm', '2 hours', 'in 1 month', 'noon',
+    'in 2 weeks', 'friday at 9am', 'in 30 minutes', 'tonight', 'next week', 'in 5 hours', 'at 8:30pm',
+    'tomorrow morning', 'on monday', 'in 10 mins', '2024-12-31', 'december 25', '7am', 'in an hour',
+    'next month', 'this evening', 'in 45 minutes', 'sunday', 'tomorrow 10am', 'in 3 hours', '11:45', 'in 6 months',
+]
+
+ZONE = zoneinfo.ZoneInfo('Europe/Amsterdam')
+DAY = datetime.datetime(2026, 10, 25, tzinfo=ZONE)
+
+
+def same(cached, direct) -> bool:
+    if cached is None or direct is None:
+        return cached is direct
+    dt, status, begin, end = cached
+    other_dt, other_status, other_begin, other_end = direct
+    return (dt, begin, end, status.hasDate, status.hasTime, status.accuracy) == (
+        other_dt, other_begin, other_end, other_status.hasDate, other_status.hasTime, other_status.accuracy
+    )
+
+
+def main(count: int) -> int:
+    rng = random.Random(1)
+    nows = [DAY + datetime.timedelta(seconds=rng.randrange(86400), microseconds=rng.randrange(10**6)) for _ in range(count)]
+
+    cache = ParseCache()
+    mismatches = 0
+    for kind, parser in (('nlp', HumanTime._nlp), ('dt', HumanTime._parse_dt)):
+        for now in nows:
+            for phrase in PHRASES:
+                if not same(cache.parse(kind, phrase, now, parser), parser(phrase, now)):
+                    mismatches += 1
+                    print(f'  {kind} {phrase!r} at {now}')
+    print(f'{mismatches} mismatches, {len(cache.entries)} entries, {cache.hits} hits, {cache.misses} misses')
+
+    start = time.perf_counter()
+    for now in nows:
+        for phrase in PHRASES:
+            HumanTime._nlp(phrase, now)
+    direct = (time.perf_counter() - start) / (len(nows) * len(PHRASES))
+
+    start = time.perf_counter()
+    for now in nows:
+        for phrase in PHRASES:
+            cache.parse('nlp', phrase, now, HumanTime._nlp)
+    hit = (time.perf_counter() - start) / (len(nows) * len(PHRASES))
+
+    cold = ParseCache()
+    start = time.perf_counter()
+    for phrase in PHRASES:
+        cold.parse('nlp', phrase, nows[0], HumanTime._nlp)
+    miss = (time.perf_counter() - start) / len(PHRASES)
+
+    print(f'calendar.nlp {direct * 1e6:6.1f}us, cache hit {hit * 1e6:5.1f}us, cache miss {miss * 1e6:6.1f}us per call')
+    return 1 if mismatches else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(int(sys.argv[1]) if len(sys.argv) > 1 else 60))
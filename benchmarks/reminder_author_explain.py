@@ -0,0 +1,89 @@
+"""
+EXPLAIN of the reminder list query before and after the timers.author_id migration.
+
+    python -m benchmarks.reminder_author_explain [DSN] [ROWS]
+
+Everything happens on a temporary timers table inside a transaction that is rolled
+back, the real table is never touched. DSN defaults to config.DBURI.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import sys
+
+import asyncpg
+
+SCHEMA = '''CREATE TEMPORARY TABLE timers (
+                id SERIAL PRIMARY KEY,
+                expires TIMESTAMPTZ,
+                created TIMESTAMPTZ DEFAULT now(),
+                event TEXT,
+                extra JSONB DEFAULT '{}'::jsonb,
+                timezone TEXT NOT NULL DEFAULT 'UTC'
+            );
+            CREATE INDEX timers_expires_idx ON timers (expires);'''
+
+# 9 in 10 timers are reminders spread over 5000 users, the rest are other events
+SEED = '''INSERT INTO timers (expires, event, extra)
+          SELECT now() + g * interval '1 second',
+                 CASE WHEN g % 10 = 0 THEN 'tempmute' ELSE 'reminder' END,
+                 jsonb_build_object('args', jsonb_build_array(100000000000000000 + g % 5000, 1, 'reminder text ' || g),
+                                    'kwargs', '{}'::jsonb)
+          FROM generate_series(1, $1) g;'''
+
+# The author_id section of migrations.sql
+MIGRATION = '''ALTER TABLE timers ADD COLUMN author_id BIGINT;
+               UPDATE timers SET author_id = (extra #>> '{args,0}')::bigint
+               WHERE event = 'reminder';
+               CREATE INDEX timers_reminder_author_idx ON timers (author_id, expires)
+               WHERE event = 'reminder';'''
+
+BEFORE = '''SELECT id, expires, extra #>> '{args,2}'
+            FROM timers
+            WHERE event = 'reminder'
+            AND extra #>> '{args,0}' = $1
+            ORDER BY expires
+            LIMIT 10;'''
+
+AFTER = '''SELECT id, expires, extra #>> '{args,2}'
+           FROM timers
+           WHERE event = 'reminder'
+           AND author_id = $1
+           ORDER BY expires
+           LIMIT 10;'''
+
+AUTHOR = 100000000000000042
+
+
+async def explain(connection: asyncpg.Connection, query: str, *args: object) -> str:
+    rows = await connection.fetch(f'EXPLAIN (ANALYZE, BUFFERS) {query}', *args)
+    return '\n'.join(row[0] for row in rows)
+
+
+async def main(dsn: str, count: int) -> None:
+    connection = await asyncpg.connect(dsn)
+    try:
+        transaction = connection.transaction()
+        await transaction.start()
+        try:
+            await connection.execute(SCHEMA)
+            await connection.execute(SEED, count)
+            await connection.execute('ANALYZE timers;')
+            print(f'-- before, {count} timers\n{await explain(connection, BEFORE, str(AUTHOR))}\n')
+
+            await connection.execute(MIGRATION)
+            await connection.execute('ANALYZE timers;')
+            print(f'-- after\n{await explain(connection, AFTER, AUTHOR)}')
+        finally:
+            await transaction.rollback()
+    finally:
+        await connection.close()
+
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1:
+        dsn = sys.argv[1]
+    else:
+        from config import DBURI as dsn
+    asyncio.run(main(dsn, int(sys.argv[2]) if len(sys.argv) > 2 else 200_000))
@@ -0,0 +1,138 @@
+"""
+Differential check and timing of utils.time.FastTimeParser against parsedatetime.
+
+    python -m benchmarks.time_fast_path [NOWS]
+
+Every phrase of the corpus, alone and followed by each tail, is parsed at NOWS random
+source times spread over a year in several timezones plus the DST change days. Whenever
+the fast path answers, its result has to match what parsedatetime gives for the same
+input: HumanTime._nlp for the partial UserFriendlyTime parse, HumanTime._parse_dt for
+the full HumanTime one. The only accepted difference is seconds, minutes and hours
+across a UTC offset change, where the fast path counts elapsed time and parsedatetime
+moves the wall clock. Exits with status 1 on any other mismatch.
+"""
+
+from __future__ import annotations
+
+import datetime
+import random
+import sys
+import time
+import zoneinfo
+from typing import Optional
+
+from utils.time import FastTimeParser, HumanTime, ParseResult
+
+PHRASES = [
+    'tomorrow', 'Tomorrow', 'tomorrow at 5pm', 'tomorrow at 17:30', 'tomorrow at 12am', 'tomorrow at 12pm',
+    '5pm', 'at 5pm', '5:30pm', 'at 9am', '12am', '12pm', '17:30', 'at 08:05', '0:15', '23:59', '5 pm', '11:45 am',
+    'monday', 'Friday', 'on sunday', 'next monday', 'next friday', 'next sunday', 'on wednesday',
+    '3 days', 'in 3 days', '2 hours', 'in 2 hours', '10 minutes', 'in 10 mins', '30 secs', '1 sec', 'an hour',
+    'in an hour', 'a day', 'in a week', '2 weeks', '1 month', 'in 3 months', 'a year', '2 years', '1 hr',
+    '90 minutes', '45 seconds', '2025-12-31', '2024-02-29', '2026-01-05 17:30', 'in 100 days', '1000 minutes',
+    # parsedatetime only, these have to fall through
+    'noon', 'tonight', 'next week', 'december 25', 'friday at 9am', 'tomorrow morning', '2026-01-05T17:30',
+]
+
+# What usually follows the time in a reminder, some of them continue the time itself
+TAILS = [
+    '', ' buy milk', ', buy milk', '. take out trash', ' to call mom', ' do the thing', ' remind me',
+    ' check the oven at 5', ' feed the cat', ' ping bob', '! yay', ' 5pm', ' at 5pm', ' friday', ' tomorrow',
+    ' in 2 hours', ' and then', ' morning', ' noon', ' jan 5',
+]
+
+ZONES = ['UTC', 'America/New_York', 'Europe/Berlin', 'Asia/Kolkata', 'Australia/Lord_Howe']
+
+ELAPSED_UNITS = ('sec', 'min', 'hour', 'hr')
+
+
+def source_times(count: int) -> list[datetime.datetime]:
+    rng = random.Random(1)
+    start = datetime.datetime(2026, 1, 1, tzinfo=datetime.timezone.utc)
+    nows = []
+    for _ in range(count):
+        zone = zoneinfo.ZoneInfo(rng.choice(ZONES))
+        offset = datetime.timedelta(seconds=rng.randrange(365 * 86400), microseconds=rng.randrange(10**6))
+        nows.append((start + offset).astimezone(zone))
+
+    # Shortly before the clocks change
+    for name, day in (('America/New_York', (3, 8)), ('America/New_York', (11, 1)),
+                      ('Europe/Berlin', (3, 29)), ('Europe/Berlin', (10, 25)),
+                      ('Australia/Lord_Howe', (4, 5)), ('Australia/Lord_Howe', (10, 4))):
+        nows.append(datetime.datetime(2026, *day, 1, 30, tzinfo=zoneinfo.ZoneInfo(name)))
+    return nows
+
+
+def difference(argument: str, now: datetime.datetime, fast: ParseResult, slow: Optional[ParseResult]) -> Optional[str]:
+    if slow is None:
+        return 'parsedatetime found nothing'
+
+    dt, status, begin, end = fast
+    other_dt, other_status, other_begin, other_end = slow
+    if (begin, end) != (other_begin, other_end):
+        return f'span {begin}:{end} != {other_begin}:{other_end}'
+    if (status.hasDate, status.hasTime) != (other_status.hasDate, other_status.hasTime):
+        return f'status {status} != {other_status}'
+    # The caller replaces the time of date only results with the current time
+    same = dt == other_dt if status.hasTime else dt.date() == other_dt.date()
+    if not same:
+        if status.hasTime and any(unit in argument.lower() for unit in ELAPSED_UNITS):
+            zone = now.tzinfo
+            if now.utcoffset() != dt.replace(tzinfo=zone).utcoffset() or now.utcoffset() != other_dt.replace(tzinfo=zone).utcoffset():
+                return None
+        return f'{dt} != {other_dt}'
+    return None
+
+
+def check(parser: FastTimeParser, nows: list[datetime.datetime]) -> tuple[int, int, list[str]]:
+    total = answered = 0
+    mismatches = []
+    for now in nows:
+        for phrase in PHRASES:
+            for tail in TAILS:
+                argument = phrase + tail
+                total += 1
+                fast = parser.parse(argument, now, partial=True)
+                if fast is not None:
+                    answered += 1
+                    why = difference(argument, now, fast, HumanTime._nlp(argument, now))
+                    if why:
+                        mismatches.append(f'nlp {argument!r} at {now}: {why}')
+
+            total += 1
+            fast = parser.parse(phrase, now)
+            if fast is not None:
+                answered += 1
+                why = difference(phrase, now, fast, HumanTime._parse_dt(phrase, now))
+                if why:
+                    mismatches.append(f'dt {phrase!r} at {now}: {why}')
+    return total, answered, mismatches
+
+
+def timing(parser: FastTimeParser, nows: list[datetime.datetime]) -> None:
+    arguments = [phrase + ' buy milk' for phrase in PHRASES if parser.parse(phrase + ' buy milk', nows[0], partial=True)]
+    for name, parse in (
+        ('fast path', lambda argument, now: parser.parse(argument, now, partial=True)),
+        ('parsedatetime', HumanTime._nlp),
+    ):
+        start = time.perf_counter()
+        for now in nows:
+            for argument in arguments:
+                parse(argument, now)
+        elapsed = time.perf_counter() - start
+        print(f'{name:>14}: {elapsed / (len(nows) * len(arguments)) * 1e6:7.1f}us per reminder')
+
+
+def main(count: int) -> int:
+    parser = FastTimeParser()
+    nows = source_times(count)
+    total, answered, mismatches = check(parser, nows)
+    print(f'{total} inputs, {answered} answered by the fast path, {len(mismatches)} mismatches')
+    for line in mismatches[:50]:
+        print(f'  {line}')
+    timing(parser, nows[:20])
+    return 1 if mismatches else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(int(sys.argv[1]) if len(sys.argv) > 1 else 60))
@@ -0,0 +1,100 @@
+"""
+Timezone autocomplete, FinderIndex against running finder over the whole table.
+
+    python -m benchmarks.timezone_search
+
+Typing is replayed one keystroke at a time: a fixed list of common searches (including
+non ASCII, regex characters and raw identifiers) and a few hundred random alias prefixes.
+The aliases come from the CLDR snapshot when one has been built, otherwise they are
+derived from the IANA names. Every keystroke has to give the same results, in the same
+order, as finder. Exits with status 1 on a mismatch.
+"""
+
+from __future__ import annotations
+
+import random
+import statistics
+import sys
+import time
+import zoneinfo
+from typing import Callable
+
+from cogs.timezone import FinderIndex, Timezone
+from utils.cldr import load_snapshot
+from utils.fuzzy import finder
+
+SEARCHES = [
+    'new york', 'los angeles', 'london', 'tokyo', 'sao paulo', 'são', 'zurich', 'zür', 'kolkata', 'berlin', 'est',
+    'pacific time', 'syd', 'ss', 'istanbul', 'reykjavik', 'kk', 'xyz', 'z', 'a', 'America/New', 'europe/ber',
+    'Asia/Kol', 'etc/gmt+5', 'ſ', 'İ', '.*', 'q',
+]
+
+
+def aliases_for(zones: list[str]) -> dict[str, str]:
+    snapshot = load_snapshot()
+    if snapshot is not None:
+        aliases = snapshot.aliases
+    else:
+        aliases = {}
+        for zone in zones:
+            parts = zone.split('/')
+            aliases[f"{parts[-1].replace('_', ' ')}, {parts[0]}"] = zone
+        # Case folding and non ASCII that the CLDR descriptions contain
+        for description in ('São Paulo, Brazil', 'Zürich, Switzerland', 'Curaçao', 'Reykjavík, Iceland', 'İstanbul, Türkiye'):
+            aliases[description] = 'UTC'
+    aliases.update(Timezone.TIMEZONE_ALIASES)
+    return aliases
+
+
+def keystrokes(aliases: dict[str, str]) -> list[str]:
+    rng = random.Random(0)
+    queries = [search[:i] for search in SEARCHES for i in range(1, len(search) + 1)]
+    names = list(aliases)
+    for _ in range(300):
+        name = rng.choice(names)
+        queries += [name[:i] for i in range(1, min(len(name), 12) + 1)]
+    return queries
+
+
+def replay(func: Callable[[str], list[str]], queries: list[str]) -> tuple[float, float, float]:
+    times = []
+    for query in queries:
+        start = time.perf_counter()
+        func(query)[:25]
+        times.append((time.perf_counter() - start) * 1e6)
+    times.sort()
+    return statistics.mean(times), times[len(times) // 2], times[int(len(times) * 0.99)]
+
+
+def main() -> int:
+    zones = sorted(zoneinfo.available_timezones())
+    aliases = aliases_for(zones)
+
+    start = time.perf_counter()
+    alias_index = FinderIndex(aliases)
+    zone_index = FinderIndex(zones)
+    print(f'{len(aliases)} aliases and {len(zones)} zones indexed in {(time.perf_counter() - start) * 1e3:.1f}ms')
+
+    queries = keystrokes(aliases)
+    names = list(aliases)
+    mismatches = 0
+    for query in queries:
+        for index, table in ((alias_index, names), (zone_index, zones)):
+            if index.find(query) != finder(query, table):
+                mismatches += 1
+                print(f'  {query!r}')
+    print(f'{len(queries)} keystrokes replayed against both tables, {mismatches} mismatches')
+
+    for label, func in (
+        ('finder over aliases', lambda query: finder(query, names)),
+        ('indexed aliases', alias_index.find),
+        ('finder over zones', lambda query: finder(query, zones)),
+        ('indexed zones', zone_index.find),
+    ):
+        mean, p50, p99 = replay(func, queries)
+        print(f'{label:>20}: mean {mean:7.1f}us, p50 {p50:7.1f}us, p99 {p99:7.1f}us')
+    return 1 if mismatches else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
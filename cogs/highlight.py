@@ -1,21 +1,22 @@
 from __future__ import annotations
 
 import re
+import time
 import logging
 import asyncio
 from typing import Union
 from asyncio import TimeoutError
-from collections import defaultdict
+from collections import defaultdict, deque, OrderedDict
 from datetime import datetime, timedelta
-from typing import TYPE_CHECKING, Optional, Literal
+from typing import TYPE_CHECKING, Any, Optional, Literal, NamedTuple
 
 import asyncpg
 import discord
 from discord import app_commands
-from discord.ext import commands
+from discord.ext import commands, tasks
 
 from utils.fuzzy import finder
-from utils.cache import ExpiringCache
+from utils.cache import ExpiringCache, register_attribute
 
 if TYPE_CHECKING:
     from main import SnowflakeBot
@@ -31,56 +32,421 @@ REPLIES_SETTINGS_TEXT = {
     2: 'On: Only when not pinged'
 }
 
+# Highlight DMs for the same user within this many seconds are sent together
+COALESCE_SECONDS = 5
+DELIVERY_WORKERS = 4
+DELIVERY_RETRIES = 5
+# Cached read permissions of a member are recomputed after this many seconds even without a gateway event,
+# and each guild keeps at most this many members cached
+READ_PERMISSIONS_TTL = 3600
+READ_PERMISSIONS_MAXSIZE = 2000
+
+
+_TOKEN_REGEX = re.compile(r'\w+')
+
+
+def _is_word_char(char: str) -> bool:
+    # Same definition as the unicode \w class in the re module
+    return char.isalnum() or char == '_'
+
+
+def _is_boundary(text: str, index: int) -> bool:
+    """Equivalent of regex \\b at the given index"""
+    before = index > 0 and _is_word_char(text[index - 1])
+    after = index < len(text) and _is_word_char(text[index])
+    return before != after
+
+
+class HighlightMatcher:
+    """Finds every (user, trigger) hit for a guild in a single pass over the message.
+
+    Plain word triggers are looked up per message token in the word to subscribers index,
+    so the cost depends on the message length rather than the number of subscribers.
+    Phrases and triggers containing punctuation go through an Aho-Corasick automaton.
+    Matches follow the same rules as ``\\b(word)s?\\b``, with two differences from the
+    per user ``re.IGNORECASE`` regex this replaced:
+
+    - Case is folded with str.lower() on the message, like the triggers are when added.
+      Characters the regex treated as case variants of each other without str.lower()
+      mapping them together no longer match, e.g. long s and s, final sigma and sigma,
+      the micro sign and mu, or the theta symbol and theta. "İ" lowercases to "i̇", so it
+      matches a trigger containing "i̇" rather than "i". Most others, the Kelvin sign and
+      capital sharp s included, match as before.
+    - When several triggers of a user match at the same position, the longest one is
+      reported, where the regex reported whichever one the user added first.
+    """
+
+    __slots__ = ('_subscribers', '_goto', '_fail', '_output')
+
+    def __init__(self, subscribers: dict[str, set[int]]) -> None:
+        # Snapshot the index so later cache edits can't desync it from the automaton
+        self._subscribers: dict[str, frozenset[int]] = {
+            word: frozenset(user_ids) for word, user_ids in subscribers.items() if user_ids
+        }
+
+        goto: list[dict[str, int]] = [{}]
+        output: list[list[str]] = [[]]
+        for word in self._subscribers:
+            if _TOKEN_REGEX.fullmatch(word):
+                continue
+            node = 0
+            for char in word:
+                child = goto[node].get(char)
+                if child is None:
+                    child = goto[node][char] = len(goto)
+                    goto.append({})
+                    output.append([])
+                node = child
+            output[node].append(word)
+
+        # Breadth first so a node's failure link is always resolved before its children
+        fail = [0] * len(goto)
+        queue = deque(goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for char, child in goto[node].items():
+                queue.append(child)
+                state = fail[node]
+                while state and char not in goto[state]:
+                    state = fail[state]
+                fail[child] = goto[state].get(char, 0) if node else 0
+                output[child].extend(output[fail[child]])
+
+        self._goto: list[dict[str, int]] = goto
+        self._fail: list[int] = fail
+        self._output: list[list[str]] = output
+
+    def __bool__(self) -> bool:
+        return bool(self._subscribers)
+
+    @staticmethod
+    def _add_hits(hits: dict[int, tuple[int, int]], user_ids: frozenset[int], start: int, stop: int) -> None:
+        # Keep the earliest match per user, preferring the longest one, like the regex would
+        for user_id in user_ids:
+            best = hits.get(user_id)
+            if best is None or start < best[0] or (start == best[0] and stop > best[1]):
+                hits[user_id] = (start, stop)
+
+    def _search_phrases(self, text: str, hits: dict[int, tuple[int, int]]) -> None:
+        goto, fail, output = self._goto, self._fail, self._output
+        node = 0
+        for end, char in enumerate(text, 1):
+            while node and char not in goto[node]:
+                node = fail[node]
+            node = goto[node].get(char, 0)
+            for word in output[node]:
+                start = end - len(word)
+                if not _is_boundary(text, start):
+                    continue
+                # The regex tries the plural first then backtracks to the bare word
+                if text[end:end + 1] == 's' and _is_boundary(text, end + 1):
+                    stop = end + 1
+                elif _is_boundary(text, end):
+                    stop = end
+                else:
+                    continue
+                self._add_hits(hits, self._subscribers[word], start, stop)
+
+    def search(self, content: str) -> dict[int, str]:
+        """Returns the first trigger matched for every user, as it appears in the message"""
+        text = content.lower()
+        # str.lower can change the length of some unicode strings, only slice the original when it is safe
+        source = content if len(text) == len(content) else text
+        subscribers = self._subscribers
+
+        hits: dict[int, tuple[int, int]] = {}  # user_id: (start, end)
+        for match in _TOKEN_REGEX.finditer(text):
+            token = match.group()
+            start, stop = match.span()
+            # A token is a full \w+ run so it already sits on word boundaries,
+            # the only candidates are the token itself and the token without its plural
+            user_ids = subscribers.get(token)
+            if user_ids:
+                self._add_hits(hits, user_ids, start, stop)
+            if len(token) > 1 and token[-1] == 's':
+                user_ids = subscribers.get(token[:-1])
+                if user_ids:
+                    self._add_hits(hits, user_ids, start, stop)
+
+        if len(self._goto) > 1:
+            self._search_phrases(text, hits)
+
+        return {user_id: source[start:stop] for user_id, (start, stop) in hits.items()}
+
+
+class MessageBuffer:
+    """Bounded ring buffer of recent messages per channel, used to build highlight context.
+
+    A channel is only trusted once the buffer has been recording it for the whole
+    requested window, otherwise it is cold and the caller has to fall back to the history.
+    """
+
+    def __init__(self, *, max_channels: int = 1000, max_messages: int = 50, max_age: timedelta = timedelta(minutes=5)) -> None:
+        self.max_channels: int = max_channels
+        self.max_messages: int = max_messages
+        self.max_age: timedelta = max_age
+        self._channels: OrderedDict[int, deque[discord.Message]] = OrderedDict()
+        self._since: dict[int, datetime] = {}  # channel_id: when we started recording it
+        # Anything before this may have been lost to an eviction
+        self._horizon: datetime = discord.utils.utcnow()
+        self.hits: int = 0
+        self.misses: int = 0
+
+    def __len__(self) -> int:
+        return len(self._channels)
+
+    def get_stats(self) -> tuple[int, int]:
+        return self.hits, self.misses
+
+    def append(self, message: discord.Message) -> None:
+        channel_id = message.channel.id
+        buffer = self._channels.get(channel_id)
+        if buffer is None:
+            buffer = self._channels[channel_id] = deque(maxlen=self.max_messages)
+            self._since[channel_id] = self._horizon
+            if len(self._channels) > self.max_channels:
+                evicted, _ = self._channels.popitem(last=False)
+                del self._since[evicted]
+                self._horizon = discord.utils.utcnow()
+        else:
+            self._channels.move_to_end(channel_id)
+
+        buffer.append(message)
+        cutoff = message.created_at - self.max_age
+        while buffer[0].created_at < cutoff:
+            buffer.popleft()
+
+    def replace(self, message: discord.Message) -> None:
+        buffer = self._channels.get(message.channel.id)
+        if not buffer:
+            return
+        for index, msg in enumerate(buffer):
+            if msg.id == message.id:
+                buffer[index] = message
+                return
+
+    def remove(self, message: discord.Message) -> None:
+        buffer = self._channels.get(message.channel.id)
+        if not buffer:
+            return
+        try:
+            buffer.remove(message)
+        except ValueError:
+            pass
+
+    def prune(self) -> None:
+        """Drop channels that have not had a message within max_age"""
+        cutoff = discord.utils.utcnow() - self.max_age
+        for channel_id in [c for c, buffer in self._channels.items() if not buffer or buffer[-1].created_at < cutoff]:
+            del self._channels[channel_id]
+            del self._since[channel_id]
+
+    def context(self, message: discord.Message, *, after: datetime, limit: int) -> Optional[list[discord.Message]]:
+        """Returns up to limit messages before message and after the given time, oldest first.
+        Returns None if the channel buffer is cold."""
+        buffer = self._channels.get(message.channel.id)
+        if buffer is None or self._since[message.channel.id] > after:
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        prev = [msg for msg in buffer if after < msg.created_at and msg.id < message.id]
+        return prev[-limit:]
+
+
+class PendingHighlight(NamedTuple):
+    embed: discord.Embed
+    message: discord.Message
+    word: Optional[str]
+    queued_at: float
+
+
+class ActivityTracker:
+    """Last time each user did something (message, typing, reaction) in a channel.
+
+    One listener per event type feeds this, highlight delivery then only has to ask
+    whether a user was active in a channel since the trigger.
+    """
+
+    def __init__(self, *, max_age: float = 300) -> None:
+        self.max_age: float = max_age
+        self._last_seen: dict[tuple[int, int], float] = {}  # (channel_id, user_id): time.monotonic()
+
+    def __len__(self) -> int:
+        return len(self._last_seen)
+
+    def touch(self, channel_id: int, user_id: int) -> None:
+        self._last_seen[(channel_id, user_id)] = time.monotonic()
+
+    def active_since(self, channel_id: int, user_id: int, since: float) -> bool:
+        seen = self._last_seen.get((channel_id, user_id))
+        return seen is not None and seen >= since
+
+    def prune(self) -> None:
+        cutoff = time.monotonic() - self.max_age
+        self._last_seen = {k: t for k, t in self._last_seen.items() if t >= cutoff}
+
 
 class Highlights(commands.Cog):
-    highlights: dict[int, dict[int, re.Pattern]]  # guild_id: {user_id: re.Pattern}
-    ignores: dict[int, defaultdict[str, list[int]]]  # user_id: {user/channel: [target_ids]}
+    highlights: dict[int, dict[str, set[int]]]  # guild_id: {word: {user_id}}
+    matchers: dict[int, HighlightMatcher]  # guild_id: HighlightMatcher
+    ignores: dict[int, dict[str, frozenset[int]]]  # user_id: {user/channel: {target_ids}}
+    ignored_channels: dict[int, frozenset[int]]  # channel_id: {user_ids ignoring it}
     replies: dict[int, int]  # user_id: setting (0 = off, 1 = on always, 2 = no pings only)
+    digests: dict[int, int]  # user_id: digest interval in minutes
 
     def __init__(self, bot: SnowflakeBot):
         self.bot: SnowflakeBot = bot
-        self.highlights = defaultdict(dict)
-        self.ignores = defaultdict(lambda: defaultdict(list))
+        self.highlights = defaultdict(lambda: defaultdict(set))
+        self.matchers = {}
+        self.ignores = {}
+        self.ignored_channels = {}
+        # guild_id: {user_id: {channel_id: can read}}
+        self._read_permissions: defaultdict[int, ExpiringCache] = defaultdict(
+            lambda: ExpiringCache(seconds=READ_PERMISSIONS_TTL, maxsize=READ_PERMISSIONS_MAXSIZE)
+        )
+        self._unresolved_members: defaultdict[int, set[int]] = defaultdict(set)  # guild_id: {user_id}
         self.replies = {}
-        self.recent_triggers = ExpiringCache(seconds=60)
+        self.digests = {}
+        self.recent_triggers = ExpiringCache(seconds=60, maxsize=10000)
+        self.message_buffer = MessageBuffer()
+        self.activity = ActivityTracker()
+        self._pending_highlights: dict[int, list[PendingHighlight]] = {}  # user_id: [PendingHighlight]
+        self._delivery_queue: asyncio.Queue[int] = asyncio.Queue()
+        self.delivery_latency: deque[float] = deque(maxlen=500)
+        self._delivery_workers = [self.bot.loop.create_task(self.delivery_worker()) for _ in range(DELIVERY_WORKERS)]
         self.bot.loop.create_task(self.populate_cache())
+        self.prune_caches.start()
+        self.deliver_digests.start()
+
+        register_attribute('Highlights.highlights', self, 'highlights')
+        register_attribute('Highlights.ignores', self, 'ignores')
+        register_attribute('Highlights.ignored_channels', self, 'ignored_channels')
+        register_attribute('Highlights.recent_triggers', self, 'recent_triggers')
+        register_attribute('Highlights.message_buffer', self, 'message_buffer', counters=lambda b: b.get_stats())
+        register_attribute('Highlights.activity', self, 'activity')
+        register_attribute('Highlights.read_permissions', self, '_read_permissions')
+        self.bot.bus.subscribe('highlights', self.on_highlights_changed)
+
+    async def cog_unload(self) -> None:
+        self.bot.bus.unsubscribe('highlights', self.on_highlights_changed)
+        self.prune_caches.cancel()
+        self.deliver_digests.cancel()
+        for worker in self._delivery_workers:
+            worker.cancel()
+
+    @tasks.loop(minutes=5)
+    async def prune_caches(self):
+        self.message_buffer.prune()
+        self.activity.prune()
+
+    def rebuild_matcher(self, guild_id: int) -> None:
+        """Rebuild the highlight matcher for a single guild after its triggers changed"""
+        guild_highlights = self.highlights.get(guild_id)
+        if not guild_highlights:
+            self.highlights.pop(guild_id, None)
+            self.matchers.pop(guild_id, None)
+            return
+        self.matchers[guild_id] = HighlightMatcher(guild_highlights)
 
-    def create_user_regex(self, words) -> re.Pattern:
-        return re.compile(r'\b(' + '|'.join(map(re.escape, words)) + r')s?\b', re.IGNORECASE)
-
-    async def make_guild_cache(self, records: list[asyncpg.Record], guild: discord.Guild) -> dict[int, re.Pattern]:
-        collect_words = defaultdict(list)
-        for record in records:
-            collect_words[record['id']].append(record['word'])
-
+    def remove_user_highlights(self, user_id: int, guild_id: int) -> None:
+        """Remove a user from every trigger they subscribe to in a guild, does not rebuild the matcher"""
+        guild_highlights = self.highlights.get(guild_id)
+        if not guild_highlights:
+            return
+        for word in [w for w, user_ids in guild_highlights.items() if user_id in user_ids]:
+            guild_highlights[word].discard(user_id)
+            if not guild_highlights[word]:
+                del guild_highlights[word]
+
+    async def make_guild_cache(self, collect_words: dict[int, list[str]], guild: discord.Guild) -> tuple[defaultdict[str, set[int]], list[int]]:
+        """Build the word index for a guild from {user_id: [words]}, also returns the users that left the guild"""
+        if not guild.chunked:
+            # Resolve every member in one gateway request instead of a fetch_member per user
+            await guild.chunk()
+
+        subscribers = defaultdict(set)
         left_guild = []
-        for user_id in collect_words:
-            try:
-                member = guild.get_member(user_id) or (await guild.fetch_member(user_id))
-            except discord.NotFound:
+        for user_id, words in collect_words.items():
+            if guild.get_member(user_id) is None:
                 left_guild.append(user_id)
-                query = '''DELETE FROM highlights WHERE id=$1 AND guild=$2;'''
-                await self.bot.pool.execute(query, user_id, guild.id)
-                log.info('Member %s not found in guild %s, deleting highlights...', user_id, guild.id)
                 continue
-
-        return {user_id: self.create_user_regex(words) for user_id, words in collect_words.items() if user_id not in left_guild}
+            for word in words:
+                subscribers[word.lower()].add(user_id)
+        return subscribers, left_guild
 
     async def fetch_all_highlights(self) -> None:
-        query = '''SELECT id, word FROM highlights WHERE guild=$1;'''
-        for guild in self.bot.guilds:
-            records = await self.bot.pool.fetch(query, guild.id)
-            if not records:
+        start = time.perf_counter()
+        collect: defaultdict[int, defaultdict[int, list[str]]] = defaultdict(lambda: defaultdict(list))  # guild_id: {user_id: [words]}
+        rows = 0
+        query = '''SELECT guild, id, word FROM highlights;'''
+        async with self.bot.pool.acquire() as con, con.transaction():
+            async for record in con.cursor(query, prefetch=1000):
+                collect[record['guild']][record['id']].append(record['word'])
+                rows += 1
+        fetched = time.perf_counter()
+
+        stale_users: list[int] = []
+        stale_guilds: list[int] = []
+        for guild_id, collect_words in collect.items():
+            guild = self.bot.get_guild(guild_id)
+            if guild is None:
                 continue
-            guild_regex = await self.make_guild_cache(records, guild=guild)
-            if guild_regex:
-                self.highlights[guild.id] = guild_regex
+            guild_highlights, left_guild = await self.make_guild_cache(collect_words, guild=guild)
+            stale_users.extend(left_guild)
+            stale_guilds.extend(guild_id for _ in left_guild)
+            if guild_highlights:
+                self.highlights[guild_id] = guild_highlights
+                self.rebuild_matcher(guild_id)
+        built = time.perf_counter()
+
+        if stale_users:
+            query = '''DELETE FROM highlights h
+                       USING unnest($1::bigint[], $2::bigint[]) AS stale(id, guild)
+                       WHERE h.id = stale.id AND h.guild = stale.guild;'''
+            await self.bot.pool.execute(query, stale_users, stale_guilds)
+        purged = time.perf_counter()
+
+        log.info('Highlight cache warmed up in %.2fms: fetched %s rows for %s guilds in %.2fms, '
+                 'resolved members and built matchers in %.2fms, purged %s departed members in %.2fms',
+                 (purged - start) * 1000, rows, len(collect), (fetched - start) * 1000,
+                 (built - fetched) * 1000, len(stale_users), (purged - built) * 1000)
 
     async def fetch_ignores(self) -> None:
         query = '''SELECT * FROM hl_ignores;'''
         records = await self.bot.pool.fetch(query)
+        collect: defaultdict[int, defaultdict[str, set[int]]] = defaultdict(lambda: defaultdict(set))
+        reverse: defaultdict[int, set[int]] = defaultdict(set)
         for r in records:
-            self.ignores[r['id']][r['type']].append(r['target'])
+            collect[r['id']][r['type']].add(r['target'])
+            if r['type'] == 'channel':
+                reverse[r['target']].add(r['id'])
+
+        self.ignores = {
+            user_id: {target_type: frozenset(targets) for target_type, targets in ignores.items()}
+            for user_id, ignores in collect.items()
+        }
+        self.ignored_channels = {channel_id: frozenset(user_ids) for channel_id, user_ids in reverse.items()}
+
+    def set_user_ignores(self, user_id: int, ignores: dict[str, frozenset[int]]) -> None:
+        """Swap in a new ignore set for a user and update the channel reverse index to match"""
+        old_channels = self.ignores.get(user_id, {}).get('channel', frozenset())
+        new_channels = ignores.get('channel', frozenset())
+
+        for channel_id in old_channels - new_channels:
+            remaining = self.ignored_channels.get(channel_id, frozenset()) - {user_id}
+            if remaining:
+                self.ignored_channels[channel_id] = remaining
+            else:
+                self.ignored_channels.pop(channel_id, None)
+        for channel_id in new_channels - old_channels:
+            self.ignored_channels[channel_id] = self.ignored_channels.get(channel_id, frozenset()) | {user_id}
+
+        ignores = {target_type: targets for target_type, targets in ignores.items() if targets}
+        if ignores:
+            self.ignores[user_id] = ignores
+        else:
+            self.ignores.pop(user_id, None)
 
     async def fetch_dm_mentions(self) -> None:
         query = '''SELECT * FROM hl_replies;'''
@@ -88,54 +454,103 @@ class Highlights(commands.Cog):
         for record in records:
             self.replies[record['id']] = record['state']
 
+    async def fetch_digests(self) -> None:
+        query = '''SELECT id, interval_minutes FROM hl_digests;'''
+        records = await self.bot.pool.fetch(query)
+        for record in records:
+            self.digests[record['id']] = record['interval_minutes']
+
     async def populate_cache(self) -> None:
         await self.bot.wait_until_ready()
         await self.fetch_all_highlights()
         await self.fetch_ignores()
         await self.fetch_dm_mentions()
+        await self.fetch_digests()
+
+    async def publish_change(self, kind: Literal['highlights', 'ignores', 'replies', 'digests'], user_id: int, guild_id: Optional[int] = None) -> None:
+        """Tell the other processes to reload this user's settings of that kind"""
+        await self.bot.bus.publish('highlights', {'kind': kind, 'user': user_id, 'guild': guild_id})
+
+    async def on_highlights_changed(self, data: Optional[dict[str, Any]]) -> None:
+        if data is None:
+            self.highlights.clear()
+            self.matchers.clear()
+            self.replies.clear()
+            self.digests.clear()
+            await self.fetch_all_highlights()
+            await self.fetch_ignores()
+            await self.fetch_dm_mentions()
+            await self.fetch_digests()
+            return
+
+        user_id = data['user']
+        if data['kind'] == 'highlights':
+            await self.update_user_highlights(user_id, data['guild'])
+        elif data['kind'] == 'ignores':
+            await self.update_user_ignores(user_id)
+        elif data['kind'] == 'replies':
+            query = '''SELECT state FROM hl_replies WHERE id=$1;'''
+            state = await self.bot.pool.fetchval(query, user_id)
+            if state is None:
+                self.replies.pop(user_id, None)
+            else:
+                self.replies[user_id] = state
+        elif data['kind'] == 'digests':
+            query = '''SELECT interval_minutes FROM hl_digests WHERE id=$1;'''
+            interval = await self.bot.pool.fetchval(query, user_id)
+            if interval is None:
+                self.digests.pop(user_id, None)
+            else:
+                self.digests[user_id] = interval
 
     async def delete_highlights(self, user_id: int, guild_id: int) -> None:
         query = '''DELETE FROM highlights WHERE id=$1 AND guild=$2;'''
         await self.bot.pool.execute(query, user_id, guild_id)
-        self.highlights[guild_id].pop(user_id, None)
-        if not self.highlights[guild_id]:
-            self.highlights.pop(guild_id, None)
+        self.remove_user_highlights(user_id, guild_id)
+        self.rebuild_matcher(guild_id)
+        await self.publish_change('highlights', user_id, guild_id)
 
     async def delete_replies(self, user_id: int) -> None:
         query = '''DELETE FROM hl_replies WHERE id=$1;'''
         await self.bot.pool.execute(query, user_id)
         self.replies.pop(user_id, None)
+        await self.publish_change('replies', user_id)
+
+    async def delete_digest(self, user_id: int) -> None:
+        query = '''DELETE FROM hl_digests WHERE id=$1;'''
+        await self.bot.pool.execute(query, user_id)
+        query = '''DELETE FROM hl_digest_pending WHERE user_id=$1;'''
+        await self.bot.pool.execute(query, user_id)
+        self.digests.pop(user_id, None)
+        await self.publish_change('digests', user_id)
 
     async def update_user_highlights(self, user_id: int, guild_id: int):
         query = '''SELECT word FROM highlights WHERE guild=$1 AND id=$2;'''
         records = await self.bot.pool.fetch(query, guild_id, user_id)
-        if not records:
-            self.highlights[guild_id].pop(user_id, None)
-            if not self.highlights[guild_id]:
-                self.highlights.pop(guild_id, None)
-            return
-        self.highlights[guild_id][user_id] = self.create_user_regex([r['word'] for r in records])
+        self.remove_user_highlights(user_id, guild_id)
+        for r in records:
+            self.highlights[guild_id][r['word'].lower()].add(user_id)
+        self.rebuild_matcher(guild_id)
 
     async def update_user_ignores(self, user_id: int):
         query = '''SELECT type, target FROM hl_ignores WHERE id=$1;'''
         records = await self.bot.pool.fetch(query, user_id)
-        if not records:
-            self.ignores.pop(user_id, None)
-            return
+        collect = defaultdict(set)
         for r in records:
-            self.ignores[user_id][r['type']].append(r['target'])
+            collect[r['type']].add(r['target'])
+        self.set_user_ignores(user_id, {target_type: frozenset(targets) for target_type, targets in collect.items()})
 
     def should_ignore(self, user_id: int, message: discord.Message) -> bool:
         """Check if message should be ignored, returns True if it should be ignored"""
         if message.author.id == user_id:
             return True
 
+        if user_id in self.ignored_channels.get(message.channel.id, ()):
+            return True
+
         ignores = self.ignores.get(user_id)
-        if ignores:
-            if message.author.id in ignores.get('user', []):
-                return True
-            elif message.channel.id in ignores.get('channel', []):
-                return True
+        if ignores and message.author.id in ignores.get('user', ()):
+            return True
         return False
 
     async def get_msg_context(self, message: discord.Message, minutes: int = 5, limit: int = 50) -> tuple[list[discord.Message], list[discord.Message]]:
@@ -144,8 +559,13 @@ class Highlights(commands.Cog):
 
         # get all messages within the last few minutes, default 5
         # we will do it in a task so we can start the wait_for sooner
+        # the message buffer already has these unless the channel was not recorded long enough
         async def fetch_prev() -> list[discord.Message]:
-            return [msg async for msg in message.channel.history(limit=limit, after=now - timedelta(minutes=minutes), before=message)]
+            after = now - timedelta(minutes=minutes)
+            prev = self.message_buffer.context(message, after=after, limit=limit)
+            if prev is None:
+                prev = [msg async for msg in message.channel.history(limit=limit, after=after, before=message)]
+            return prev
 
         task = self.bot.loop.create_task(fetch_prev())
 
@@ -208,25 +628,156 @@ class Highlights(commands.Cog):
 
         return '\n'.join(context)
 
-    async def _send_highlight_dm(self, user_id: int, embed: discord.Embed, message: discord.Message, word: Optional[str]) -> None:
+    def queue_highlight(self, user_id: int, embed: discord.Embed, message: discord.Message, word: Optional[str]) -> None:
+        """Queue a highlight DM, anything else for the same user within the coalesce window is sent with it"""
+        item = PendingHighlight(embed, message, word, time.monotonic())
+        pending = self._pending_highlights.get(user_id)
+        if pending is not None:
+            pending.append(item)
+            return
+        self._pending_highlights[user_id] = [item]
+        self.bot.loop.call_later(COALESCE_SECONDS, self._delivery_queue.put_nowait, user_id)
+
+    async def delivery_worker(self) -> None:
+        while True:
+            user_id = await self._delivery_queue.get()
+            pending = self._pending_highlights.pop(user_id, [])
+            try:
+                if pending:
+                    await self._send_highlight_dm(user_id, pending)
+            except Exception:
+                log.exception('Failed to deliver %s highlights to user %s', len(pending), user_id)
+            finally:
+                self._delivery_queue.task_done()
+
+    @staticmethod
+    def _chunk_embeds(embeds: list[discord.Embed]) -> list[list[discord.Embed]]:
+        # A message can have at most 10 embeds and 6000 characters across them
+        chunks: list[list[discord.Embed]] = []
+        size = 0
+        for embed in embeds:
+            if not chunks or len(chunks[-1]) == 10 or size + len(embed) > 6000:
+                chunks.append([])
+                size = 0
+            chunks[-1].append(embed)
+            size += len(embed)
+        return chunks
+
+    async def _send_with_backoff(self, user: discord.User, embeds: list[discord.Embed]) -> None:
+        for attempt in range(DELIVERY_RETRIES):
+            try:
+                await user.send(embeds=embeds)
+            except discord.HTTPException as e:
+                # discord.py already retries 429s internally, this only kicks in once it gives up
+                if e.status != 429 or attempt == DELIVERY_RETRIES - 1:
+                    raise
+                await asyncio.sleep(2 ** attempt)
+            else:
+                return
+
+    async def _send_highlight_dm(self, user_id: int, pending: list[PendingHighlight]) -> None:
+        guild_ids = {item.message.guild.id for item in pending}
         try:
             user = self.bot.get_user(user_id) or (await self.bot.fetch_user(user_id))
-            await user.send(embed=embed)
+            for embeds in self._chunk_embeds([item.embed for item in pending]):
+                await self._send_with_backoff(user, embeds)
         except discord.NotFound:
             log.info('User %s not found, deleting highlights and replies permanently', user_id)
-            await self.delete_highlights(user_id, message.guild.id)
+            for guild_id in guild_ids:
+                await self.delete_highlights(user_id, guild_id)
             await self.delete_replies(user_id)
             return
         except discord.Forbidden as e:
             if "Cannot send messages to this user" in e.text:
                 log.info('User %s has DMs disabled, deleting highlights and replies from cache', user_id)
-                self.highlights[message.guild.id].pop(user_id, None)
+                for guild_id in guild_ids:
+                    self.remove_user_highlights(user_id, guild_id)
+                    self.rebuild_matcher(guild_id)
                 self.replies.pop(user_id, None)
                 # await self.delete_highlights(user_id, message.guild.id)
                 # await self.delete_replies(user_id)
                 return
         else:
-            self.bot.dispatch('highlight_sent', user_id, message, word)
+            now = time.monotonic()
+            for item in pending:
+                self.delivery_latency.append(now - item.queued_at)
+                self.bot.dispatch('highlight_sent', user_id, item.message, item.word)
+
+    async def add_to_digest(self, message: discord.Message, user_id: int, word: Optional[str]) -> None:
+        query = '''INSERT INTO hl_digest_pending(user_id, guild, channel, message, word, content, created)
+                   VALUES($1, $2, $3, $4, $5, $6, $7);'''
+        content = self.format_message(message, bold=True, word=word)
+        await self.bot.pool.execute(query, user_id, message.guild.id, message.channel.id, message.id, word, content,
+                                    message.created_at)
+
+    def build_digest_embeds(self, records: list[asyncpg.Record]) -> list[discord.Embed]:
+        entries = []
+        for r in records:
+            guild = self.bot.get_guild(r['guild'])
+            channel = guild and guild.get_channel_or_thread(r['channel'])
+            location = f'{guild or r["guild"]} | #{channel or r["channel"]}'
+            trigger = f'Highlight trigger: {r["word"]}' if r['word'] else 'Reply'
+            jump_url = f'https://discord.com/channels/{r["guild"]}/{r["channel"]}/{r["message"]}'
+            entries.append(f'**{location}** - {trigger} - [Jump to message]({jump_url})\n{r["content"][:500]}')
+
+        # Split the entries over as many embeds as needed to stay under the description limit
+        descriptions = ['']
+        for entry in entries:
+            if descriptions[-1] and len(descriptions[-1]) + len(entry) + 2 > 4000:
+                descriptions.append('')
+            descriptions[-1] += f'{entry}\n\n'
+
+        embeds = [discord.Embed(description=description, colour=0x00B0F4) for description in descriptions]
+        embeds[0].title = f'Highlight digest: {len(records)} notification{"s" if len(records) > 1 else ""}'
+        embeds[-1].timestamp = records[-1]['created']
+        return embeds
+
+    async def send_digest(self, user_id: int, records: list[asyncpg.Record]) -> None:
+        try:
+            user = self.bot.get_user(user_id) or (await self.bot.fetch_user(user_id))
+            for embeds in self._chunk_embeds(self.build_digest_embeds(records)):
+                await self._send_with_backoff(user, embeds)
+        except discord.NotFound:
+            log.info('User %s not found, deleting highlight digest permanently', user_id)
+            await self.delete_digest(user_id)
+        except discord.Forbidden:
+            log.info('User %s has DMs disabled, dropping %s digest entries', user_id, len(records))
+        except discord.HTTPException as e:
+            log.warning('Failed to send user %s their digest (%s), dropping %s entries', user_id, e, len(records))
+
+    @tasks.loop(minutes=1)
+    async def deliver_digests(self):
+        # Claim every pending trigger for users whose interval has passed in one statement,
+        # so a restart in between can't deliver anything twice
+        query = '''WITH due AS (
+                       UPDATE hl_digests d SET last_sent = now()
+                       WHERE d.last_sent + make_interval(mins => d.interval_minutes) <= now()
+                       AND EXISTS (SELECT 1 FROM hl_digest_pending p WHERE p.user_id = d.id)
+                       RETURNING d.id
+                   )
+                   DELETE FROM hl_digest_pending p USING due
+                   WHERE p.user_id = due.id
+                   RETURNING p.user_id, p.guild, p.channel, p.message, p.word, p.content, p.created;'''
+        # An exception escaping the loop would stop it for good, just try again next minute
+        try:
+            records = await self.bot.pool.fetch(query)
+        except Exception:
+            log.exception('Failed to claim due highlight digests')
+            return
+
+        collect: defaultdict[int, list[asyncpg.Record]] = defaultdict(list)
+        for record in sorted(records, key=lambda r: r['created']):
+            collect[record['user_id']].append(record)
+
+        for user_id, user_records in collect.items():
+            try:
+                await self.send_digest(user_id, user_records)
+            except Exception:
+                log.exception('Failed to deliver %s digest entries to user %s', len(user_records), user_id)
+
+    @deliver_digests.before_loop
+    async def before_deliver_digests(self):
+        await self.bot.wait_until_ready()
 
     async def send_highlight_notif(self, message: discord.Message, user_id: int, word: str, prev: list[discord.Message], after: list[discord.Message]) -> None:
         now = message.created_at
@@ -239,6 +790,10 @@ class Highlights(commands.Cog):
             return
         self.recent_triggers[(message.channel.id, user_id, word.lower())] = True
 
+        if user_id in self.digests:
+            await self.add_to_digest(message, user_id, word)
+            return
+
         context = self.build_full_context(prev, after, word)
 
         embed = discord.Embed(
@@ -249,7 +804,7 @@ class Highlights(commands.Cog):
         )
         embed.set_footer(text=f'Highlight trigger: {word}')
 
-        await self._send_highlight_dm(user_id, embed, message, word)
+        self.queue_highlight(user_id, embed, message, word)
 
     async def send_reply_notification(self, message: discord.Message, user_id: int, word: None, prev: list[discord.Message], after: list[discord.Message]) -> None:
         now = message.created_at
@@ -272,6 +827,10 @@ class Highlights(commands.Cog):
             return
         self.recent_triggers[(message.channel.id, user_id, word)] = True
 
+        if user_id in self.digests:
+            await self.add_to_digest(message, user_id, word)
+            return
+
         context = self.build_full_context(prev, after, word)
 
         embed = discord.Embed(
@@ -286,45 +845,43 @@ class Highlights(commands.Cog):
             ref = message.reference.resolved.jump_url
             embed.description += f' | [Replying to]({ref})'
 
-        await self._send_highlight_dm(user_id, embed, message, word)
-
-    async def wait_for_activity(self, message: discord.Message, user_ids: set[int], timeout: int = 20) -> set[int]:
-        """Wait for activity from a list of user_ids"""
-        active = set()
-
-        # We will leverage the check functions to just add the user into the active set
-        # and return False to keep the wait_for running for the full timeout
-        def message_check(m: discord.Message):
-            if m.author.id in user_ids and m.channel == message.channel:
-                active.add(m.author.id)
-            return False
-
-        def typing_check(c: discord.abc.Messageable, u: discord.User, w: datetime):
-            if u.id in user_ids and c == message.channel:
-                active.add(u.id)
-            return False
-
-        def reaction_check(r: discord.Reaction, u: discord.Member):
-            if u.id in user_ids and r.message.channel == message.channel:
-                active.add(u.id)
-            return False
-
-        tasks_names = [
-            ('message', message_check),
-            ('typing', typing_check),
-            ('reaction_add', reaction_check)
-        ]
-        tasks = [asyncio.create_task(self.bot.wait_for(name, check=check)) for name, check in tasks_names]
-        done, pending = await asyncio.wait(tasks, timeout=timeout)
-        # these tasks never complete since all our checks return False
-        for task in tasks:
-            try:
-                # task.add_done_callback(lambda f: f.exception())
-                task.cancel()
-            except Exception:
-                pass
+        self.queue_highlight(user_id, embed, message, word)
+
+    def can_read(self, channel: Union[discord.abc.GuildChannel, discord.Thread], member: discord.Member) -> bool:
+        members = self._read_permissions[channel.guild.id]
+        cache = members.get(member.id)
+        if cache is None:
+            cache = members[member.id] = {}
+        try:
+            return cache[channel.id]
+        except KeyError:
+            can_read = cache[channel.id] = channel.permissions_for(member).read_messages
+            return can_read
+
+    def queue_member_lookup(self, guild: discord.Guild, user_id: int) -> None:
+        pending = self._unresolved_members[guild.id]
+        if not pending:
+            self.bot.loop.create_task(self.resolve_members(guild))
+        pending.add(user_id)
+
+    async def resolve_members(self, guild: discord.Guild) -> None:
+        """Look up every queued member of a guild in bulk, deleting highlights for those that left"""
+        # Give other lookups for this guild a moment to pile up
+        await asyncio.sleep(1)
+        user_ids = self._unresolved_members.pop(guild.id, set())
+        found = set()
+        to_query = list(user_ids)
+        try:
+            for i in range(0, len(to_query), 100):
+                members = await guild.query_members(user_ids=to_query[i:i + 100], limit=100, cache=True)
+                found.update(m.id for m in members)
+        except asyncio.TimeoutError:
+            log.warning('Timed out resolving %s highlight members in guild %s', len(user_ids), guild.id)
+            return
 
-        return active
+        for user_id in user_ids - found:
+            log.warning('Highlight member %s not found in guild %s, deleting...', user_id, guild.id)
+            await self.delete_highlights(user_id, guild.id)
 
     async def handle_highlights(self, message: discord.Message, highlights: dict[int, Optional[str]]) -> None:
         """Handle highlights"""
@@ -334,38 +891,43 @@ class Highlights(commands.Cog):
                 if user_id == self.bot.owner_id:
                     filtered[user_id] = word
                 else:
-                    try:
-                        member = message.guild.get_member(user_id) or (await message.guild.fetch_member(user_id))
-                    except discord.NotFound:
-                        log.warning('Highlight member %s not found in guild %s, deleting...', user_id, message.guild.id)
-                        await self.delete_highlights(user_id, message.guild.id)
-                    else:
-                        if message.channel.permissions_for(member).read_messages:
-                            filtered[user_id] = word
+                    member = message.guild.get_member(user_id)
+                    if member is None:
+                        # Don't hold up this message with a fetch, resolve it in the background for next time
+                        self.queue_member_lookup(message.guild, user_id)
+                    elif self.can_read(message.channel, member):
+                        filtered[user_id] = word
         if not filtered:
             return
-        active_task = self.bot.loop.create_task(self.wait_for_activity(message, set(filtered.keys()), timeout=20))
+        started = time.monotonic()
         prev, after = await self.get_msg_context(message, minutes=5)
-        active_users = await active_task
+        # Give everyone the full 20 seconds to show they are active before notifying them
+        remaining = started + 20 - time.monotonic()
+        if remaining > 0:
+            await asyncio.sleep(remaining)
+
         for user_id, word in filtered.items():
-            if user_id in active_users:
+            if self.activity.active_since(message.channel.id, user_id, started):
                 continue
             if word:
-                self.bot.loop.create_task(self.send_highlight_notif(message, user_id, word, prev, after))
+                await self.send_highlight_notif(message, user_id, word, prev, after)
             else:
-                self.bot.loop.create_task(self.send_reply_notification(message, user_id, word, prev, after))
+                await self.send_reply_notification(message, user_id, word, prev, after)
 
     @commands.Cog.listener()
     async def on_message(self, message: discord.Message):
-        if message.guild is None or message.author.bot or message.webhook_id is not None:
+        if message.guild is None:
+            return
+
+        self.message_buffer.append(message)
+        self.activity.touch(message.channel.id, message.author.id)
+        if message.author.bot or message.webhook_id is not None:
             return
 
         to_send = {}
-        if message.guild.id in self.highlights:
-            for member_id, regex in self.highlights[message.guild.id].items():
-                match = regex.search(message.content)
-                if match:
-                    to_send[member_id] = match.group(0)
+        matcher = self.matchers.get(message.guild.id)
+        if matcher:
+            to_send.update(matcher.search(message.content))
 
         if message.type is discord.MessageType.reply:
             if message.reference and isinstance(message.reference.resolved, discord.Message):
@@ -373,9 +935,74 @@ class Highlights(commands.Cog):
                 if replied_author in self.replies and replied_author not in to_send:
                     to_send[replied_author] = None
 
+        # Drop everyone ignoring this channel in one go before any per-user work
+        ignoring = self.ignored_channels.get(message.channel.id)
+        if ignoring and to_send:
+            to_send = {user_id: word for user_id, word in to_send.items() if user_id not in ignoring}
+
         if to_send:
             await self.handle_highlights(message, to_send)
 
+    @commands.Cog.listener()
+    async def on_typing(self, channel: discord.abc.Messageable, user: Union[discord.User, discord.Member], when: datetime):
+        if isinstance(user, discord.Member):
+            self.activity.touch(channel.id, user.id)
+
+    @commands.Cog.listener()
+    async def on_raw_reaction_add(self, payload: discord.RawReactionActionEvent):
+        if payload.guild_id is not None:
+            self.activity.touch(payload.channel_id, payload.user_id)
+
+    @commands.Cog.listener()
+    async def on_message_edit(self, before: discord.Message, after: discord.Message):
+        if after.guild is not None:
+            self.message_buffer.replace(after)
+
+    @commands.Cog.listener()
+    async def on_message_delete(self, message: discord.Message):
+        if message.guild is not None:
+            self.message_buffer.remove(message)
+
+    # Read permission cache invalidation
+
+    @commands.Cog.listener()
+    async def on_guild_role_update(self, before: discord.Role, after: discord.Role):
+        if before.permissions != after.permissions or before.position != after.position:
+            self._read_permissions.pop(after.guild.id, None)
+
+    @commands.Cog.listener()
+    async def on_guild_role_delete(self, role: discord.Role):
+        self._read_permissions.pop(role.guild.id, None)
+
+    @commands.Cog.listener()
+    async def on_guild_channel_update(self, before: discord.abc.GuildChannel, after: discord.abc.GuildChannel):
+        # Clear the whole guild since threads and synced channels inherit from this one
+        if before.overwrites != after.overwrites or before.category != after.category:
+            self._read_permissions.pop(after.guild.id, None)
+
+    @commands.Cog.listener()
+    async def on_guild_channel_delete(self, channel: discord.abc.GuildChannel):
+        for cache in self._read_permissions.get(channel.guild.id, {}).values():
+            cache.pop(channel.id, None)
+
+    @commands.Cog.listener()
+    async def on_guild_update(self, before: discord.Guild, after: discord.Guild):
+        if before.owner_id != after.owner_id:
+            self._read_permissions.pop(after.id, None)
+
+    @commands.Cog.listener()
+    async def on_guild_remove(self, guild: discord.Guild):
+        self._read_permissions.pop(guild.id, None)
+
+    @commands.Cog.listener()
+    async def on_member_update(self, before: discord.Member, after: discord.Member):
+        if before.roles != after.roles:
+            self._read_permissions.get(after.guild.id, {}).pop(after.id, None)
+
+    @commands.Cog.listener()
+    async def on_member_remove(self, member: discord.Member):
+        self._read_permissions.get(member.guild.id, {}).pop(member.id, None)
+
     @commands.hybrid_group(aliases=['hl'])
     @commands.guild_only()
     async def highlight(self, ctx: Context):
@@ -406,6 +1033,7 @@ class Highlights(commands.Cog):
             else:
                 await ctx.send(f'Successfully added trigger `{trigger}`', ephemeral=True)
             await self.update_user_highlights(ctx.author.id, ctx.guild.id)
+            await self.publish_change('highlights', ctx.author.id, ctx.guild.id)
 
     @highlight.command(name='remove')
     @app_commands.describe(trigger='The trigger to remove, not case-sensitive')
@@ -425,6 +1053,7 @@ class Highlights(commands.Cog):
             else:
                 await ctx.send(f'Successfully removed trigger `{trigger}`', ephemeral=True)
             await self.update_user_highlights(ctx.author.id, ctx.guild.id)
+            await self.publish_change('highlights', ctx.author.id, ctx.guild.id)
 
     @highlight_remove.autocomplete('trigger')
     async def highlight_remove_auto_complete(self, interaction: discord.Interaction, current: str) -> list[app_commands.Choice[str]]:
@@ -483,6 +1112,7 @@ class Highlights(commands.Cog):
         query = '''INSERT INTO hl_replies(id, state) VALUES($1, $2);'''
         await self.bot.pool.execute(query, ctx.author.id, setting)
         self.replies[ctx.author.id] = setting
+        await self.publish_change('replies', ctx.author.id)
         await ctx.tick(True)
         await ctx.send(f'Successfully set your highlight replies to: `{REPLIES_SETTINGS_TEXT[setting]}`', delete_after=7)
 
@@ -504,8 +1134,33 @@ class Highlights(commands.Cog):
         query = '''INSERT INTO hl_replies(id, state) VALUES($1, $2) ON CONFLICT (id) DO UPDATE SET state=$2;'''
         await self.bot.pool.execute(query, interaction.user.id, setting.value)
         self.replies[interaction.user.id] = setting.value
+        await self.publish_change('replies', interaction.user.id)
         await interaction.followup.send(f'Successfully set your highlight replies to: `{setting.name}`', ephemeral=True)
 
+    @highlight.command(name='digest')
+    @app_commands.describe(interval='Minutes between digests, 0 turns digests off')
+    async def highlight_digest(self, ctx: Context, interval: commands.Range[int, 0, 1440]):
+        """Get your highlights as one summarized DM every few minutes
+
+        Use 0 to turn digests off and go back to getting a DM per highlight
+        """
+        if interval == 0:
+            await self.delete_digest(ctx.author.id)
+            msg = 'Successfully turned off highlight digests'
+        else:
+            query = '''INSERT INTO hl_digests(id, interval_minutes) VALUES($1, $2)
+                       ON CONFLICT (id) DO UPDATE SET interval_minutes=$2;'''
+            await self.bot.pool.execute(query, ctx.author.id, interval)
+            self.digests[ctx.author.id] = interval
+            await self.publish_change('digests', ctx.author.id)
+            msg = f'Successfully set your highlight digest to every {interval} minute{"s" if interval > 1 else ""}'
+
+        if not ctx.interaction:
+            await ctx.tick(True)
+            await ctx.send(msg, delete_after=7)
+        else:
+            await ctx.send(msg, ephemeral=True)
+
     @highlight.command(name='import')
     async def highlight_import(self, ctx: Context, *, server: str):
         """Import your highlights from another server"""
@@ -537,6 +1192,7 @@ class Highlights(commands.Cog):
         for record in records:
             await self.bot.pool.execute(query, ctx.author.id, ctx.guild.id, record['word'])
         await self.update_user_highlights(ctx.author.id, ctx.guild.id)
+        await self.publish_change('highlights', ctx.author.id, ctx.guild.id)
 
         if not ctx.interaction:
             await ctx.tick(True)
@@ -556,16 +1212,18 @@ class Highlights(commands.Cog):
     async def add_block(self, user_id: int, target_type: Literal['user', 'channel'], target_id: int):
         query = '''INSERT INTO hl_ignores(id, type, target) VALUES($1, $2, $3);'''
         await self.bot.pool.execute(query, user_id, target_type, target_id)
-        self.ignores[user_id][target_type].append(target_id)
+        ignores = dict(self.ignores.get(user_id, {}))
+        ignores[target_type] = ignores.get(target_type, frozenset()) | {target_id}
+        self.set_user_ignores(user_id, ignores)
+        await self.publish_change('ignores', user_id)
 
     async def remove_block(self, user_id: int, target_type: Literal['user', 'channel'], target_id: int):
         query = '''DELETE FROM hl_ignores WHERE id=$1 AND type=$2 AND target=$3;'''
         result = await self.bot.pool.execute(query, user_id, target_type, target_id)
-        self.ignores[user_id][target_type].remove(target_id)
-        if not self.ignores[user_id][target_type]:
-            self.ignores[user_id].pop(target_type)
-            if not self.ignores[user_id]:
-                self.ignores.pop(user_id)
+        ignores = dict(self.ignores.get(user_id, {}))
+        ignores[target_type] = ignores.get(target_type, frozenset()) - {target_id}
+        self.set_user_ignores(user_id, ignores)
+        await self.publish_change('ignores', user_id)
         return result
 
     @highlight.command(name='ignore', aliases=['block'], with_app_command=False)
@@ -760,13 +1418,34 @@ class Highlights(commands.Cog):
 
         query = '''DELETE FROM hl_ignores WHERE id=$1;'''
         await self.bot.pool.execute(query, ctx.author.id)
-        self.ignores.pop(ctx.author.id, None)
+        self.set_user_ignores(ctx.author.id, {})
+        await self.publish_change('ignores', ctx.author.id)
         if not ctx.interaction:
             await ctx.tick(True)
             await ctx.send('Successfully cleared all your highlight blocks', delete_after=7)
         else:
             await ctx.send(f'{await ctx.tick(reaction=False)} Successfully cleared all your highlight blocks', ephemeral=True)
 
+    @highlight.command(name='stats', with_app_command=False, hidden=True)
+    @commands.is_owner()
+    async def highlight_stats(self, ctx: Context):
+        """Highlight delivery and cache stats"""
+        latencies = sorted(self.delivery_latency)
+        if latencies:
+            p95 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))]
+            latency = f'avg {sum(latencies) / len(latencies):.2f}s, p95 {p95:.2f}s over {len(latencies)} DMs'
+        else:
+            latency = 'No highlights delivered yet'
+
+        hits, misses = self.message_buffer.get_stats()
+        e = discord.Embed(title='Highlight Stats', colour=discord.Colour.blurple())
+        e.add_field(name='Delivery Queue', value=f'{len(self._pending_highlights)} users pending, '
+                                                 f'{self._delivery_queue.qsize()} ready to send', inline=False)
+        e.add_field(name='Delivery Latency', value=latency, inline=False)
+        e.add_field(name='Message Buffer', value=f'{len(self.message_buffer)} channels, {hits} hits, {misses} misses', inline=False)
+        e.add_field(name='Activity Tracker', value=f'{len(self.activity)} entries', inline=False)
+        await ctx.send(embed=e)
+
     @highlight.command(with_app_command=False, name='info')
     async def highlight_info(self, ctx: Context):
         """Explains how highlight works"""
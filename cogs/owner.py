@@ -1,4 +1,5 @@
 import io
+import json
 import textwrap
 import traceback
 import tabulate
@@ -8,6 +9,7 @@ from contextlib import redirect_stdout
 import discord
 from discord.ext import commands
 
+from utils.cache import get_cache_stats, export_cache_metrics
 from utils.errors import BlacklistedUser
 from utils.converters import CaseInsensitiveUser, CaseInsensitiveMember, CachedUserID, CachedGuildID
 from utils.global_utils import cleanup_code, copy_context, upload_hastebin, send_or_hastebin
@@ -18,6 +20,10 @@ class OwnerCog(commands.Cog, name='Owner'):
         self.bot = bot
         self._last_result = None
         bot.loop.create_task(self.get_blacklist())
+        bot.bus.subscribe('blacklist', self.on_blacklist_changed)
+
+    async def cog_unload(self):
+        self.bot.bus.unsubscribe('blacklist', self.on_blacklist_changed)
 
     # Applies is_owner() check for all commands in this cog
     async def cog_check(self, ctx):
@@ -225,6 +231,31 @@ class OwnerCog(commands.Cog, name='Owner'):
         else:
             await ctx.send(f'```\n{table}```')
 
+    @commands.group(name='caches', invoke_without_command=True)
+    async def cache_stats(self, ctx):
+        """Shows hits, misses, evictions, entries and approximate size of every registered cache"""
+        stats = get_cache_stats()
+        if not stats:
+            return await ctx.send('No caches registered')
+
+        def fmt(value):
+            return '-' if value is None else value
+
+        headers = ['Name', 'Hits', 'Misses', 'Evictions', 'Entries', 'Size']
+        values = [[s.name, fmt(s.hits), fmt(s.misses), fmt(s.evictions), s.entries, f'{s.size / 1024:.1f} KiB']
+                  for s in stats]
+        table = tabulate.tabulate(values, tablefmt='psql', headers=headers)
+        if len(table) > 1000:
+            await ctx.send(file=discord.File(io.BytesIO(table.encode()), filename='caches.txt'))
+        else:
+            await ctx.send(f'```\n{table}```')
+
+    @cache_stats.command(name='json')
+    async def cache_stats_json(self, ctx):
+        """Exports the cache stats as JSON"""
+        data = json.dumps(export_cache_metrics(), indent=2)
+        await ctx.send(file=discord.File(io.BytesIO(data.encode()), filename='caches.json'))
+
     @commands.command(name="shutdown")
     async def logout(self, ctx):
         """
@@ -253,10 +284,19 @@ class OwnerCog(commands.Cog, name='Owner'):
         try:
             records = await self.bot.pool.fetch(query)
         except:
-            self._blacklist = []
+            self._blacklist = set()
         else:
             self._blacklist = {record['id'] for record in records}
 
+    async def on_blacklist_changed(self, data):
+        """Another process (un)blacklisted a user, or reload everything if data is None"""
+        if data is None:
+            await self.get_blacklist()
+        elif data['blacklisted']:
+            self._blacklist.add(data['id'])
+        else:
+            self._blacklist.discard(data['id'])
+
     @commands.Cog.listener()
     async def on_guild_join(self, guild: discord.Guild):
         bots = sum([1 for m in guild.members if m.bot])
@@ -299,6 +339,7 @@ class OwnerCog(commands.Cog, name='Owner'):
                    VALUES($1, 'user', $2);'''
         await self.bot.pool.execute(query, member.id, reason)
         self._blacklist.add(member.id)
+        await self.bot.bus.publish('blacklist', {'id': member.id, 'blacklisted': True})
         await ctx.send(f'Ignoring {member}')
         await ctx.message.add_reaction('\U00002705')
 
@@ -312,6 +353,7 @@ class OwnerCog(commands.Cog, name='Owner'):
                 self._blacklist.remove(member_or_guild.id)
             except KeyError:
                 pass
+            await self.bot.bus.publish('blacklist', {'id': member_or_guild.id, 'blacklisted': False})
         await ctx.send(f'Unignoring {member_or_guild}')
         await ctx.message.add_reaction('\U00002705')
 
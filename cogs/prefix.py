@@ -8,6 +8,22 @@ class PrefixCog(commands.Cog, name='Prefix'):
     def __init__(self, bot):
         self.bot = bot
         bot.loop.create_task(self.set_mention_regex())
+        bot.bus.subscribe('prefixes', self.on_prefixes_changed)
+
+    async def cog_unload(self):
+        self.bot.bus.unsubscribe('prefixes', self.on_prefixes_changed)
+
+    async def on_prefixes_changed(self, data):
+        """Another process changed the prefixes of a guild, or of every guild if data is None"""
+        if data is None:
+            self.bot.prefixes = await self.bot.fetch_prefixes()
+            return
+        query = '''SELECT prefix FROM prefixes WHERE guild = $1;'''
+        records = await self.bot.pool.fetch(query, data['guild'])
+        if records:
+            self.bot.prefixes[data['guild']] = [r['prefix'] for r in records]
+        else:
+            self.bot.prefixes.pop(data['guild'], None)
 
     async def set_mention_regex(self):
         await self.bot.wait_until_ready()
@@ -32,6 +48,7 @@ class PrefixCog(commands.Cog, name='Prefix'):
                      VALUES($1, $2);'''
         prefixes_with_guild = [(ctx.guild.id, n) for n in new]
         await self.bot.pool.executemany(add_new, prefixes_with_guild)
+        await self.bot.bus.publish('prefixes', {'guild': ctx.guild.id})
 
     @prefix.command(aliases=['clear'])
     @commands.guild_only()
@@ -43,6 +60,7 @@ class PrefixCog(commands.Cog, name='Prefix'):
             await ctx.send(f'Note: Mentioning the bot will always be a valid prefix. Ex: {self.bot.user.mention} ping', delete_after=10)
             query = '''DELETE FROM prefixes WHERE guild = $1;'''
             await self.bot.pool.execute(query, ctx.guild.id)
+            await self.bot.bus.publish('prefixes', {'guild': ctx.guild.id})
         except KeyError:
             await ctx.send('This server is already using the default prefix: %')
 
@@ -70,6 +88,7 @@ class PrefixCog(commands.Cog, name='Prefix'):
                 added.insert(0, '%')
             prefixes_with_guild = [(ctx.guild.id, p) for p in added]
             await self.bot.pool.executemany(query, prefixes_with_guild)
+            await self.bot.bus.publish('prefixes', {'guild': ctx.guild.id})
         else:
             await ctx.send('No new prefix has been added')
 
@@ -87,6 +106,7 @@ class PrefixCog(commands.Cog, name='Prefix'):
                        WHERE guild = $1
                        AND prefix = $2;'''
             await self.bot.pool.execute(query, ctx.guild.id, prefix_to_remove)
+            await self.bot.bus.publish('prefixes', {'guild': ctx.guild.id})
             await ctx.send(f'Removed prefix: {prefix_to_remove} from this server')
         else:
             return await ctx.send('This is not an existing prefix!')
@@ -6,6 +6,7 @@ import discord
 from discord.ext import commands
 
 from utils.converters import MessageConverter
+from utils.cache import register_attribute
 
 
 def sort_emoji_role(arg1, arg2):
@@ -26,6 +27,11 @@ class ReactionRole(commands.Cog):
         self.messages = {}
         self.interacting = {}
         bot.loop.create_task(self.get_message_ids())
+        register_attribute('ReactionRole.messages', self, 'messages')
+        bot.bus.subscribe('reaction_roles', self.on_reaction_roles_changed)
+
+    async def cog_unload(self):
+        self.bot.bus.unsubscribe('reaction_roles', self.on_reaction_roles_changed)
 
     async def cog_check(self, ctx):
         if ctx.guild is None:
@@ -59,6 +65,18 @@ class ReactionRole(commands.Cog):
         query = '''SELECT * FROM reaction_roles WHERE message = $1;'''
         record = await self.bot.pool.fetchrow(query, message.id)
         self.messages[record['message']] = [record['type'], record['data'], record['channel'], record['guild']]
+        await self.bot.bus.publish('reaction_roles', {'message': message.id})
+
+    async def on_reaction_roles_changed(self, data):
+        """Another process changed the reaction roles of a message, or reload all of them if data is None"""
+        if data is None:
+            return await self.get_message_ids()
+        query = '''SELECT * FROM reaction_roles WHERE message = $1;'''
+        record = await self.bot.pool.fetchrow(query, data['message'])
+        if record is None:
+            self.messages.pop(data['message'], None)
+        else:
+            self.messages[record['message']] = [record['type'], record['data'], record['channel'], record['guild']]
 
     async def remove_interacting(self, ctx):
         def check(c):
@@ -116,6 +134,7 @@ class ReactionRole(commands.Cog):
                        WHERE message = $1;'''
             await self.bot.pool.execute(query, payload.message_id)
             del self.messages[payload.message_id]
+            await self.bot.bus.publish('reaction_roles', {'message': payload.message_id})
 
     async def create_reaction_role_with_type(self, ctx, message, role, emoji, type):
         try:
@@ -401,6 +420,7 @@ class ReactionRole(commands.Cog):
         if status == 'DELETE 0':
             return await ctx.send('Unable to remove reaction roles with that ID')
         self.messages.pop(message.id, None)
+        await self.bot.bus.publish('reaction_roles', {'message': message.id})
         await ctx.message.add_reaction('<:greenTick:602811779835494410>')
         try:
             await message.clear_reactions()
@@ -1,15 +1,18 @@
 from __future__ import annotations
 
 import asyncio
+import bisect
+import heapq
+import math
 import textwrap
 import datetime
 import traceback
-from typing import TYPE_CHECKING, Any, Optional, Self, Sequence, Annotated
+from typing import TYPE_CHECKING, Any, Callable, Optional, Self, Sequence, Annotated
 
 import asyncpg
 import discord
 from discord import app_commands
-from discord.ext import commands, tasks
+from discord.ext import commands
 
 from utils import time
 from utils.fuzzy import finder
@@ -19,6 +22,16 @@ if TYPE_CHECKING:
     from utils.context import Context
     from cogs.timezone import Timezone
 
+# The dispatcher keeps every timer expiring within this window in memory, loading at most TIMER_BATCH at once
+TIMER_WINDOW = datetime.timedelta(hours=1)
+TIMER_BATCH = 250
+# Due timers are claimed this many at a time, and at most this many are dispatched before the listeners get to start
+TIMER_FANOUT = 50
+# How long a claimed timer stays reserved for its process, another one takes it over if it is not done by then
+TIMER_LEASE = datetime.timedelta(seconds=60)
+# Timers this close are not stored in the database unless asked to, they live in a TimingWheel instead
+SHORT_TIMER_SECONDS = 60
+
 
 class SnoozeModal(discord.ui.Modal, title='Snooze'):
     duration = discord.ui.TextInput(label='Duration', placeholder='10 minutes', default='10 minutes', min_length=2)
@@ -148,54 +161,251 @@ class Timer:
         return f'<Timer created={self.created_at} expires={self.expires} event={self.event}>'
 
 
+class LagHistogram:
+    """Counts of how late timers were dispatched, in seconds"""
+
+    BUCKETS = (0.01, 0.05, 0.1, 0.5, 1, 5, 30, 60)
+
+    def __init__(self) -> None:
+        self.counts: list[int] = [0] * (len(self.BUCKETS) + 1)
+        self.total: float = 0.0
+        self.max: float = 0.0
+
+    def __len__(self) -> int:
+        return sum(self.counts)
+
+    def record(self, seconds: float) -> None:
+        seconds = max(seconds, 0.0)
+        self.counts[bisect.bisect_left(self.BUCKETS, seconds)] += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+
+    def format(self) -> str:
+        lines = [f'<= {bound}s: {count}' for bound, count in zip(self.BUCKETS, self.counts)]
+        lines.append(f'> {self.BUCKETS[-1]}s: {self.counts[-1]}')
+        return '\n'.join(lines)
+
+
+class TimingWheel:
+    """Hashed timing wheel for short timers
+
+    Timers are appended to the slot they are due in and one task advances a slot every
+    resolution seconds, firing that slot. This is one loop handle for any number of
+    pending timers instead of a sleeping task each. Timers fire less than two resolutions
+    late, never early, and the task only runs while the wheel has timers.
+    """
+
+    def __init__(self, callback: Callable[[Timer], None], *, resolution: float = 0.5, slots: int = 128) -> None:
+        self.callback: Callable[[Timer], None] = callback
+        self.resolution: float = resolution
+        self.slots: list[list[tuple[int, Timer]]] = [[] for _ in range(slots)]  # (rounds left, timer)
+        self.current: int = 0
+        self._count: int = 0
+        self._task: Optional[asyncio.Task[None]] = None
+
+    def __len__(self) -> int:
+        return self._count
+
+    def add(self, delay: float, timer: Timer) -> None:
+        # The next tick is anywhere up to one resolution away, hence the extra tick
+        ticks = max(math.ceil(delay / self.resolution), 0) + 1
+        rounds, offset = divmod(ticks, len(self.slots))
+        if offset == 0:
+            rounds, offset = rounds - 1, len(self.slots)
+        self.slots[(self.current + offset) % len(self.slots)].append((rounds, timer))
+        self._count += 1
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+
+    async def _run(self) -> None:
+        loop = asyncio.get_running_loop()
+        next_tick = loop.time()
+        while self._count:
+            next_tick += self.resolution
+            await asyncio.sleep(next_tick - loop.time())
+            self.current = (self.current + 1) % len(self.slots)
+            slot = self.slots[self.current]
+            if not slot:
+                continue
+
+            self.slots[self.current] = pending = []
+            for rounds, timer in slot:
+                if rounds:
+                    pending.append((rounds - 1, timer))
+                    continue
+                self._count -= 1
+                try:
+                    self.callback(timer)
+                except Exception:
+                    traceback.print_exc()
+
+
 class Reminders(commands.Cog):
     def __init__(self, bot: SnowflakeBot):
         self.bot: SnowflakeBot = bot
-        self._have_data: asyncio.Event = asyncio.Event()
-        self._current_timer: Optional[Timer] = None
-        self.weekly_check.start()
+        # (expires, id, timer) of every timer expiring before _window_end
+        self._timers: list[tuple[datetime.datetime, int, Timer]] = []
+        self._window_end: datetime.datetime = datetime.datetime.min.replace(tzinfo=datetime.timezone.utc)
+        self._wakeup: asyncio.Event = asyncio.Event()
+        self._added_during_refill: Optional[list[Timer]] = None
+        self.dispatch_lag: LagHistogram = LagHistogram()
+        self._fanout: asyncio.Semaphore = asyncio.Semaphore(TIMER_FANOUT)
+        self.short_timers: TimingWheel = TimingWheel(self.call_timer)
         self._task = bot.loop.create_task(self.dispatch_timers())
+        bot.bus.subscribe('timers', self.on_timer_created)
 
     async def cog_unload(self) -> None:
+        self.bot.bus.unsubscribe('timers', self.on_timer_created)
         self._task.cancel()
-        self.weekly_check.cancel()
+        self.short_timers.stop()
 
-    async def get_active_timer(self, *, days: int) -> Optional[Timer]:
-        query = '''SELECT * FROM timers WHERE expires < (now() + $1::interval) ORDER BY expires LIMIT 1'''
-        record = await self.bot.pool.fetchrow(query, datetime.timedelta(days=days))
-        if record:
-            return Timer(record=record)
+    def on_timer_created(self, data: Optional[dict[str, Any]]) -> None:
+        """Another process created a timer, refill once it is due so we can take it over if that process is gone"""
+        if data is None:
+            expires = discord.utils.utcnow()
+        else:
+            expires = datetime.datetime.fromisoformat(data['expires'])
+        if expires < self._window_end:
+            self._window_end = expires
+            self._wakeup.set()
+
+    async def refill_timers(self) -> None:
+        """Load the timers expiring within the next TIMER_WINDOW, the database is the source of truth"""
+        window_end = discord.utils.utcnow() + TIMER_WINDOW
+        # Timers leased by another process are left to it, loading them would only have us
+        # refill again straight away while they are due but can't be claimed
+        query = '''SELECT * FROM timers
+                   WHERE expires < $1
+                   AND (lease_expires IS NULL OR lease_expires < now())
+                   ORDER BY expires
+                   LIMIT $2;'''
+        leases = '''SELECT min(lease_expires) FROM timers WHERE expires < $1 AND lease_expires >= now();'''
+        # Timers created while the query runs may or may not be in its result
+        self._added_during_refill = added = []
+        try:
+            records = await self.bot.pool.fetch(query, window_end, TIMER_BATCH)
+            lease_end = await self.bot.pool.fetchval(leases, window_end)
+        finally:
+            self._added_during_refill = None
+
+        timers = [Timer(record=record) for record in records]
+        if len(timers) == TIMER_BATCH:
+            # More timers than fit in one batch, only the ones before the last loaded are known
+            window_end = timers[-1].expires
+        if lease_end is not None and lease_end < window_end:
+            # Look again once the lease runs out in case the process holding it died
+            window_end = lease_end
+
+        loaded = {timer.id for timer in timers}
+        timers.extend(timer for timer in added if timer.id not in loaded and timer.expires < window_end)
+        self._timers = [(timer.expires, timer.id, timer) for timer in timers]
+        heapq.heapify(self._timers)
+        self._window_end = window_end
+
+    def add_timer(self, timer: Timer) -> None:
+        """Merge a newly created timer into the dispatcher if it falls within the loaded window"""
+        if self._added_during_refill is not None:
+            self._added_during_refill.append(timer)
+        if timer.expires >= self._window_end:
+            return
+        heapq.heappush(self._timers, (timer.expires, timer.id, timer))
+        if self._timers[0][2] is timer:
+            self._wakeup.set()
 
-    async def call_timer(self, timer: Timer) -> None:
-        """Delete the timer from the database and dispatch the event."""
-        query = '''DELETE FROM timers WHERE id = $1'''
-        await self.bot.pool.execute(query, timer.id)
+    def discard_timer(self, timer_id: int) -> None:
+        self._timers = [entry for entry in self._timers if entry[1] != timer_id]
+        heapq.heapify(self._timers)
 
+    def call_timer(self, timer: Timer) -> None:
+        """Dispatch the event of a timer that was already claimed"""
+        self.dispatch_lag.record((discord.utils.utcnow() - timer.expires).total_seconds())
         self.bot.dispatch(f'{timer.event}_timer_complete', timer)
 
+    async def fire_due_timers(self, now: datetime.datetime) -> None:
+        """Lease every timer due by now, delete them and dispatch their events, TIMER_FANOUT at a time
+
+        Several processes can run this at once, SKIP LOCKED and the lease make sure each
+        timer is only claimed by one of them. If a process dies holding a lease, the timer
+        is claimed again once the lease runs out.
+
+        The lease only guards the window between claiming and deleting. A timer is deleted
+        before it is dispatched so nothing is delivered twice, which means a process that
+        crashes after the DELETE but before dispatching loses those timers for good.
+        Delivery is at most once.
+        """
+        claim = '''UPDATE timers
+                   SET lease_owner = $3, lease_expires = now() + $4::interval
+                   WHERE id IN (
+                       SELECT id FROM timers
+                       WHERE expires <= $1
+                       AND (lease_expires IS NULL OR lease_expires < now())
+                       ORDER BY expires
+                       LIMIT $2
+                       FOR UPDATE SKIP LOCKED
+                   )
+                   RETURNING *;'''
+        # The lease could have run out and been taken over since claiming, only our rows are ours to dispatch
+        done = '''DELETE FROM timers WHERE id = ANY($1::int[]) AND lease_owner = $2 RETURNING id;'''
+        owner = self.bot.bus.origin
+        claimed: set[int] = set()
+        while True:
+            records = await self.bot.pool.fetch(claim, now, TIMER_FANOUT, owner, TIMER_LEASE)
+            if records:
+                ids = [record['id'] for record in records]
+                claimed.update(ids)
+                deleted = {record['id'] for record in await self.bot.pool.fetch(done, ids, owner)}
+                for record in records:
+                    if record['id'] not in deleted:
+                        continue
+                    # A slot is only held until the loop comes round and starts the listeners this
+                    # dispatch scheduled, so a burst starts at most TIMER_FANOUT of them at a time
+                    # without a slow listener holding anything up
+                    await self._fanout.acquire()
+                    self.call_timer(Timer(record=record))
+                    self.bot.loop.call_soon(self._fanout.release)
+            if len(records) < TIMER_FANOUT:
+                break
+
+        skipped = False
+        while self._timers and self._timers[0][0] <= now:
+            _, timer_id, _ = heapq.heappop(self._timers)
+            skipped = skipped or timer_id not in claimed
+
+        if skipped:
+            # Either cancelled or leased by another process, in case that process
+            # dies look again once its lease runs out
+            query = '''SELECT min(lease_expires) FROM timers WHERE expires <= $1 AND lease_expires >= now();'''
+            lease_end = await self.bot.pool.fetchval(query, now)
+            if lease_end is not None and lease_end < self._window_end:
+                self._window_end = lease_end
+
     async def dispatch_timers(self) -> None:
         await self.bot.wait_until_ready()
         try:
             while not self.bot.is_closed():
-                await self._have_data.wait()
-                # can only asyncio.sleep for up to ~48 days reliably
-                # so we're gonna cap it off at 40 days
-                # see: http://bugs.python.org/issue20493
-
-                # get the next active timer within 40 days
-                # if there is no timer, we wait until we have data
-                timer = self._current_timer = await self.get_active_timer(days=40)
-                if timer is None:
-                    self._have_data.clear()
-                    continue
-
                 now = discord.utils.utcnow()
+                if now >= self._window_end:
+                    await self.refill_timers()
+
+                # Sleep until the first timer or the end of the window, whichever is sooner,
+                # add_timer wakes us up early if a sooner timer comes in
+                wake_at = self._window_end
+                if self._timers and self._timers[0][0] < wake_at:
+                    wake_at = self._timers[0][0]
+
+                if wake_at > now:
+                    self._wakeup.clear()
+                    try:
+                        await asyncio.wait_for(self._wakeup.wait(), timeout=(wake_at - now).total_seconds())
+                    except asyncio.TimeoutError:
+                        pass
+                    continue
 
-                if timer.expires >= now:
-                    to_sleep = (timer.expires - now).total_seconds()
-                    await asyncio.sleep(to_sleep)
-
-                await self.call_timer(timer)
+                await self.fire_due_timers(now)
         except asyncio.CancelledError:
             raise
         except (OSError, discord.ConnectionClosed, asyncpg.PostgresConnectionError):
@@ -213,39 +423,37 @@ class Reminders(commands.Cog):
             await self.bot.owner.send(f'```py\n{"".join(tb)}```')
             raise
 
-    async def short_timer(self, seconds: float, timer: Timer) -> None:
-        await asyncio.sleep(seconds)
-        self.bot.dispatch(f'{timer.event}_timer_complete', timer)
-
     async def create_timer(self, expires: datetime.datetime, event: str, *args: Any, **kwargs: Any) -> Timer:
+        """Create a timer that dispatches {event}_timer_complete once it expires
+
+        Timers up to SHORT_TIMER_SECONDS away are only kept in memory and are lost
+        on restart, pass persist=True to store them in the database anyway.
+        """
         try:
             now = kwargs.pop('created')
         except KeyError:
             now = discord.utils.utcnow()
 
         tz_name = kwargs.pop('timezone', 'UTC')
+        persist = kwargs.pop('persist', False)
 
         timer = Timer.temporary(event=event, args=args, kwargs=kwargs, expires=expires, created=now, timezone=tz_name)
         delta = (expires - now).total_seconds()
-        if delta <= 60:
-            self.bot.loop.create_task(self.short_timer(delta, timer))
+        if delta <= SHORT_TIMER_SECONDS and not persist:
+            self.short_timers.add((expires - discord.utils.utcnow()).total_seconds(), timer)
             return timer
 
-        query = '''INSERT INTO timers (event, created, expires, extra, timezone)
-                   VALUES ($1, $2, $3, $4, $5) RETURNING id;'''
+        query = '''INSERT INTO timers (event, created, expires, extra, timezone, author_id)
+                   VALUES ($1, $2, $3, $4, $5, $6) RETURNING id;'''
 
-        row = await self.bot.pool.fetchrow(query, event, now, expires, {'args': args, 'kwargs': kwargs}, tz_name)
+        # author_id is indexed so reminders can be looked up by their owner without reading extra,
+        # other events keep whatever they like in their first argument so it is left empty for them
+        author_id = args[0] if event == 'reminder' else None
+        row = await self.bot.pool.fetchrow(query, event, now, expires, {'args': args, 'kwargs': kwargs}, tz_name, author_id)
         timer.id = row['id']
-
-        # only set if it is 40 days or less
-        if delta <= (60 * 60 * 24 * 40):
-            self._have_data.set()
-
-        # check if new timer expires earlier than current one
-        if self._current_timer and expires < self._current_timer.expires:
-            self._task.cancel()
-            self._task = self.bot.loop.create_task(self.dispatch_timers())
-
+        self.add_timer(timer)
+        if delta <= TIMER_WINDOW.total_seconds():
+            await self.bot.bus.publish('timers', {'expires': expires.isoformat()})
         return timer
 
     @commands.Cog.listener()
@@ -384,12 +592,12 @@ class Reminders(commands.Cog):
         query = """SELECT id, expires, extra #>> '{args,2}'
                    FROM timers
                    WHERE event = 'reminder'
-                   AND extra #>> '{args,0}' = $1
+                   AND author_id = $1
                    ORDER BY expires
                    LIMIT 10;
                 """
 
-        records = await self.bot.pool.fetch(query, str(ctx.author.id))
+        records = await self.bot.pool.fetch(query, ctx.author.id)
 
         if not records:
             return await ctx.send('You do not have any reminders set.')
@@ -407,6 +615,21 @@ class Reminders(commands.Cog):
 
         await ctx.send(embed=e)
 
+    @reminder.command(name='stats', with_app_command=False, hidden=True)
+    @commands.is_owner()
+    async def reminder_stats(self, ctx: Context):
+        """Timer dispatcher stats"""
+        e = discord.Embed(title='Timer Stats', colour=discord.Colour.blurple())
+        e.add_field(name='Loaded', value=f'{len(self._timers)} timers until {time.format_dt(self._window_end, "T")}', inline=False)
+        e.add_field(name='Short Timers', value=f'{len(self.short_timers)} pending', inline=False)
+        lag = self.dispatch_lag
+        if lag:
+            summary = f'avg {lag.total / len(lag):.3f}s, max {lag.max:.3f}s over {len(lag)} timers'
+            e.add_field(name='Dispatch Lag', value=f'{summary}\n```\n{lag.format()}\n```', inline=False)
+        else:
+            e.add_field(name='Dispatch Lag', value='No timers dispatched yet', inline=False)
+        await ctx.send(embed=e)
+
     @reminder.command(name='cancel', aliases=['delete', 'remove'], ignore_extra=False)
     async def reminder_cancel(self, ctx: Context , *, id: int):
         """Cancels a reminder by ID
@@ -414,38 +637,28 @@ class Reminders(commands.Cog):
         query = """DELETE FROM timers
                    WHERE id=$1
                    AND event = 'reminder'
-                   AND extra #>> '{args,0}' = $2;
+                   AND author_id = $2;
                 """
 
-        result = await self.bot.pool.execute(query, id, str(ctx.author.id))
+        result = await self.bot.pool.execute(query, id, ctx.author.id)
 
         if result == 'DELETE 0':
             return await ctx.send('Could not delete reminder with that ID. Are you sure you own that ID?\n'
                                   'You can see your reminders with `%remind list`')
 
-        # if the current timer is being deleted, restart the task
-        if self._current_timer and self._current_timer.id == id:
-            self._task.cancel()
-            self._task = self.bot.loop.create_task(self.dispatch_timers())
+        self.discard_timer(id)
 
         await ctx.send(f'Deleted reminder {id}', ephemeral=True)
 
-    # Force a data check once a week
-    # Checks every 6day 23hr 45min
-    # In case there is a timer coming up next week and no new timers triggered a check
-    @tasks.loop(hours=167.75)
-    async def weekly_check(self):
-        self._have_data.set()
-
     @reminder_cancel.autocomplete('id')
     async def reminder_cancel_autocomplete(self, interaction: discord.Interaction, current: str) -> list[app_commands.Choice[str]]:
         query = '''SELECT id, expires, extra #>> '{args,2}' 
                    FROM timers 
                    WHERE event = 'reminder' 
-                   AND extra #>> '{args,0}' = $1 
+                   AND author_id = $1 
                    ORDER BY expires 
                    LIMIT 25;'''
-        reminders = await self.bot.pool.fetch(query, str(interaction.user.id))
+        reminders = await self.bot.pool.fetch(query, interaction.user.id)
         formatted = []
         for _id, expires, message in reminders:
             message = 'No message...' if message == '…' else message
@@ -2,15 +2,19 @@ from __future__ import annotations
 
 import asyncio
 import datetime
+import logging
+import re
+import string
 import zoneinfo
-from typing import TYPE_CHECKING, NamedTuple, Optional, Union, Annotated
+from functools import lru_cache
+from typing import TYPE_CHECKING, Iterable, NamedTuple, Optional, Union, Annotated
 
 import discord
 from discord import app_commands
 from discord.ext import commands
-from lxml import etree
 
-from utils.cache import cache
+from utils import cldr
+from utils.cache import register_attribute
 from utils.fuzzy import finder
 from utils.time import UserFriendlyTime, FriendlyTimeResult, format_dt
 
@@ -19,12 +23,69 @@ if TYPE_CHECKING:
     from main import SnowflakeBot
     from utils.context import Context
 
-
-class CLDRDataEntry(NamedTuple):
-    description: str
-    aliases: list[str]
-    deprecated: bool
-    preferred: Optional[str]
+log = logging.getLogger(__name__)
+
+
+@lru_cache(maxsize=None)
+def _search_keys(char: str) -> frozenset[str]:
+    """The lowercase ASCII characters (or the character itself) a query can match char with"""
+    if char.isascii():
+        return frozenset(char.lower())
+    # finder matches with re.IGNORECASE, which also folds e.g. U+017F to s and U+212A to k
+    return frozenset({char.lower()} | {c for c in string.ascii_lowercase if re.fullmatch(c, char, re.IGNORECASE)})
+
+
+class FinderIndex:
+    """Narrows down the strings finder has to look at for a query
+
+    finder matches the characters of the query in order, so every match contains each
+    consecutive pair of query characters in that order, though not necessarily adjacent.
+    Each of these ordered pairs maps to a bitmask of the strings containing it, ANDing
+    the masks of the pairs in a query gives the strings worth running the regex over.
+    The index only ever rules out strings that can't match so results are unchanged.
+    """
+
+    def __init__(self, items: Iterable[str]) -> None:
+        self.items: list[str] = sorted(items)
+        self._all: int = (1 << len(self.items)) - 1
+        self._chars: dict[str, int] = {}
+        self._pairs: dict[str, int] = {}
+
+        for index, item in enumerate(self.items):
+            bit = 1 << index
+            seen: set[str] = set()
+            pairs: set[str] = set()
+            for char in item:
+                keys = _search_keys(char)
+                pairs.update(before + key for before in seen for key in keys)
+                seen |= keys
+
+            for key in seen:
+                self._chars[key] = self._chars.get(key, 0) | bit
+            for pair in pairs:
+                self._pairs[pair] = self._pairs.get(pair, 0) | bit
+
+    def candidates(self, query: str) -> list[str]:
+        # Non ASCII query characters might be folded in ways we don't index, don't narrow on them
+        chars = [c.lower() if c.isascii() else None for c in query]
+        mask = self._all
+        for char in chars:
+            if char is not None:
+                mask &= self._chars.get(char, 0)
+        for before, after in zip(chars, chars[1:]):
+            if before is not None and after is not None:
+                mask &= self._pairs.get(before + after, 0)
+            if not mask:
+                return []
+
+        if mask == self._all:
+            return self.items
+        # bin() lists the bits from the most significant one, reverse it to line them up with items
+        return [item for item, bit in zip(self.items, reversed(bin(mask))) if bit == '1']
+
+    def find(self, query: str) -> list[str]:
+        """finder(query, items), only looking at the candidates for query"""
+        return finder(query, self.candidates(query))
 
 
 class TimeZone(NamedTuple):
@@ -99,96 +160,149 @@ class Timezone(commands.Cog):
         "brsao",  # America/Sao_Paulo
     )
 
+    TIMEZONE_ALIASES = {
+        'Eastern Time': 'America/New_York',
+        'Central Time': 'America/Chicago',
+        'Mountain Time': 'America/Denver',
+        'Pacific Time': 'America/Los_Angeles',
+        # (Unfortunately) special case American timezone abbreviations
+        'EST': 'America/New_York',
+        'CST': 'America/Chicago',
+        'MST': 'America/Denver',
+        'PST': 'America/Los_Angeles',
+        'EDT': 'America/New_York',
+        'CDT': 'America/Chicago',
+        'MDT': 'America/Denver',
+        'PDT': 'America/Los_Angeles',
+    }
+
+    # Fetch timezone.xml again in the background once the snapshot is older than this
+    CLDR_REFRESH_AFTER = datetime.timedelta(days=7)
+    # How often to try again when there is no snapshot and timezone.xml could not be fetched
+    CLDR_RETRY_AFTER = datetime.timedelta(hours=1)
+
     def __init__(self, bot: SnowflakeBot):
         self.bot: SnowflakeBot = bot
         self.valid_timezones = zoneinfo.available_timezones()
-        self._timezone_aliases: dict[str, str] = {
-            'Eastern Time': 'America/New_York',
-            'Central Time': 'America/Chicago',
-            'Mountain Time': 'America/Denver',
-            'Pacific Time': 'America/Los_Angeles',
-            # (Unfortunately) special case American timezone abbreviations
-            'EST': 'America/New_York',
-            'CST': 'America/Chicago',
-            'MST': 'America/Denver',
-            'PST': 'America/Los_Angeles',
-            'EDT': 'America/New_York',
-            'CDT': 'America/Chicago',
-            'MDT': 'America/Denver',
-            'PDT': 'America/Los_Angeles',
-        }
+        self._timezone_aliases: dict[str, str] = dict(self.TIMEZONE_ALIASES)
         self._default_timezones: list[app_commands.Choice[str]] = []
+        self._valid_timezone_index = FinderIndex(self.valid_timezones)
+        self._alias_index = FinderIndex(self._timezone_aliases)
+        self._cldr_refresh: Optional[asyncio.Task[None]] = None
+        # user id: IANA key, every row of the timezones table
+        self._timezones: dict[int, str] = {}
+        # IANA key: tzinfo, shared between users in the same timezone
+        self._zones: dict[str, datetime.tzinfo] = {}
+        register_attribute('Timezone.timezones', self, '_timezones')
 
     async def cog_load(self) -> None:
-        await self.parse_bcp47_timezones()
-
-    async def parse_bcp47_timezones(self) -> None:
-        async with self.bot.session.get(
-            'https://raw.githubusercontent.com/unicode-org/cldr/main/common/bcp47/timezone.xml'
-        ) as resp:
-            if resp.status != 200:
-                return
-
-            parser = etree.XMLParser(ns_clean=True, recover=True, encoding='utf-8')
-            tree = etree.fromstring(await resp.read(), parser=parser)
-
-            # Build a temporary dictionary to resolve "preferred" mappings
-            entries: dict[str, CLDRDataEntry] = {
-                node.attrib['name']: CLDRDataEntry(
-                    description=node.attrib['description'],
-                    aliases=node.get('alias', 'Etc/Unknown').split(' '),
-                    deprecated=node.get('deprecated', 'false') == 'true',
-                    preferred=node.get('preferred'),
-                )
-                for node in tree.iter('type')
-                # Filter the Etc/ entries (except UTC)
-                if not node.attrib['name'].startswith(('utcw', 'utce', 'unk'))
-                and not node.attrib['description'].startswith('POSIX')
-            }
-
-            for entry in entries.values():
-                # These use the first entry in the alias list as the "canonical" name to use when mapping the
-                # timezone to the IANA database.
-                # The CLDR database is not particularly correct when it comes to these, but neither is the IANA database.
-                # It turns out the notion of a "canonical" name is a bit of a mess. This works fine for users where
-                # this is only used for display purposes, but it's not ideal.
-                if entry.preferred is not None:
-                    preferred = entries.get(entry.preferred)
-                    if preferred is not None:
-                        self._timezone_aliases[entry.description] = preferred.aliases[0]
-                else:
-                    self._timezone_aliases[entry.description] = entry.aliases[0]
-
-            for key in self.DEFAULT_POPULAR_TIMEZONE_IDS:
-                entry = entries.get(key)
-                if entry is not None:
-                    self._default_timezones.append(app_commands.Choice(name=entry.description, value=entry.aliases[0]))
-
-    @cache(maxsize=10)
+        await self.load_user_timezones()
+        self.bot.bus.subscribe('timezones', self.on_timezones_changed)
+
+        snapshot = cldr.load_snapshot()
+        if snapshot is not None:
+            self.load_bcp47_timezones(snapshot.timezones)
+
+        if snapshot is None or discord.utils.utcnow() - snapshot.generated > self.CLDR_REFRESH_AFTER:
+            self._cldr_refresh = self.bot.loop.create_task(self.refresh_bcp47_timezones(snapshot))
+
+    async def cog_unload(self) -> None:
+        self.bot.bus.unsubscribe('timezones', self.on_timezones_changed)
+        if self._cldr_refresh is not None:
+            self._cldr_refresh.cancel()
+
+    async def load_user_timezones(self) -> None:
+        query = '''SELECT id, tz FROM timezones;'''
+        records = await self.bot.pool.fetch(query)
+        self._timezones = {r['id']: r['tz'] for r in records}
+
+    async def on_timezones_changed(self, data: Optional[dict[str, int]]) -> None:
+        """Another process changed the timezone of a user, or reload all of them if data is None"""
+        if data is None:
+            return await self.load_user_timezones()
+        query = '''SELECT tz FROM timezones WHERE id = $1;'''
+        tz = await self.bot.pool.fetchval(query, data['user'])
+        if tz is None:
+            self._timezones.pop(data['user'], None)
+        else:
+            self._timezones[data['user']] = tz
+
+    def load_bcp47_timezones(self, timezones: dict[str, tuple[str, str]]) -> None:
+        """Swap in the aliases and popular timezones from CLDR, timezones maps BCP 47 ids to (description, IANA key)"""
+        aliases = dict(self.TIMEZONE_ALIASES)
+        aliases.update(timezones.values())
+
+        defaults = [
+            app_commands.Choice(name=timezones[key][0], value=timezones[key][1])
+            for key in self.DEFAULT_POPULAR_TIMEZONE_IDS
+            if key in timezones
+        ]
+
+        index = FinderIndex(aliases)
+
+        # Built completely before assigning so lookups never see a half loaded table
+        self._timezone_aliases = aliases
+        self._alias_index = index
+        self._default_timezones = defaults
+
+    async def refresh_bcp47_timezones(self, snapshot: Optional[cldr.CLDRSnapshot]) -> None:
+        while True:
+            try:
+                timezones = await cldr.fetch_timezones(self.bot.session)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                log.warning('Could not refresh the CLDR timezone data: %s', e)
+                timezones = None
+
+            if timezones or snapshot is not None:
+                break
+            # Without a snapshot there are no CLDR aliases at all, keep trying instead of waiting for a restart
+            await asyncio.sleep(self.CLDR_RETRY_AFTER.total_seconds())
+
+        if not timezones:
+            return
+
+        if snapshot is None or timezones != snapshot.timezones:
+            self.load_bcp47_timezones(timezones)
+        # Written even when nothing changed, the new generated time is what stops the next loads from fetching again
+        try:
+            await asyncio.to_thread(cldr.write_snapshot, timezones)
+        except OSError as e:
+            log.warning('Could not save the CLDR timezone snapshot: %s', e)
+        else:
+            log.info('Refreshed the CLDR timezone snapshot with %d timezones', len(timezones))
+
     async def get_timezone(self, user_id: int) -> Optional[str]:
         """Get the timezone for a user, if it exists."""
-        query = '''SELECT tz FROM timezones WHERE id = $1;'''
-        record = await self.bot.pool.fetchrow(query, user_id)
-        return record['tz'] if record else None
+        return self._timezones.get(user_id)
 
     async def get_tzinfo(self, user_id: int) -> datetime.tzinfo:
-        tz = await self.get_timezone(user_id)
+        tz = self._timezones.get(user_id)
         if tz is None:
             return datetime.UTC
 
         try:
-            return zoneinfo.ZoneInfo(tz)
+            return self._zones[tz]
+        except KeyError:
+            pass
+
+        try:
+            zone = zoneinfo.ZoneInfo(tz)
         except zoneinfo.ZoneInfoNotFoundError:
-            return datetime.UTC
+            zone = datetime.UTC
+        self._zones[tz] = zone
+        return zone
 
     def find_timezones(self, query: str) -> list[TimeZone]:
         # A bit hacky, but if '/' is in the query then it's looking for a raw identifier
         # otherwise it's looking for a CLDR alias
         if '/' in query:
-            return [TimeZone(key=a, label=a) for a in finder(query, self.valid_timezones)]
+            return [TimeZone(key=a, label=a) for a in self._valid_timezone_index.find(query)]
 
-        keys = finder(query, self._timezone_aliases.keys())
-        return [TimeZone(label=k, key=self._timezone_aliases[k]) for k in keys]
+        aliases = self._timezone_aliases
+        keys = self._alias_index.find(query)
+        return [TimeZone(label=k, key=aliases[k]) for k in keys]
 
     @commands.hybrid_group(case_insensitive=True, aliases=['tz', 'time'])
     async def timezone(self, ctx: Context):
@@ -231,8 +345,8 @@ class Timezone(commands.Cog):
                    ON CONFLICT (id) DO UPDATE
                    SET tz=$2;'''
         await self.bot.pool.execute(query, ctx.author.id, timezone.key)
-
-        self.get_timezone.invalidate(self, ctx.author.id)
+        self._timezones[ctx.author.id] = timezone.key
+        await self.bot.bus.publish('timezones', {'user': ctx.author.id})
 
         await ctx.send(f'Your timezone is now set to: {timezone.label} (IANA ID: {timezone.key})', ephemeral=True)
 
@@ -259,7 +373,8 @@ class Timezone(commands.Cog):
         query = '''DELETE FROM timezones
                    WHERE id = $1;'''
         await self.bot.pool.execute(query, ctx.author.id)
-        self.get_timezone.invalidate(self, ctx.author.id)
+        self._timezones.pop(ctx.author.id, None)
+        await self.bot.bus.publish('timezones', {'user': ctx.author.id})
         await ctx.send('Your timezone has been removed', ephemeral=True)
 
     @timezone_set.autocomplete('timezone')
@@ -13,6 +13,7 @@ from discord.ext import commands
 from asyncpg import UniqueViolationError
 from utils.global_utils import make_naive
 from utils.converters import CaseInsensitiveVoiceChannel
+from utils.cache import register_attribute
 
 
 logger = logging.getLogger(__name__)
@@ -26,6 +27,8 @@ class Tracker(commands.Cog):
         self.vc_joins  = defaultdict(lambda: defaultdict(tuple))
         self.vc_leaves = defaultdict(lambda: defaultdict(tuple))
         # {guild: {channel: (member, datetime)}}
+        register_attribute('Tracker.vc_joins', self, 'vc_joins')
+        register_attribute('Tracker.vc_leaves', self, 'vc_leaves')
         self._default_avatar_names = {0: 'blurple',
                                       1: 'grey',
                                       2: 'green',
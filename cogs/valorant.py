@@ -13,6 +13,7 @@ from utils.converters import CaseInsensitiveMember
 from utils.views import LoginView, _2FAView
 from utils.errors import MultiFactorCodeRequired, InvalidCredentials
 from utils.global_utils import bright_color
+from utils.cache import register_attribute
 
 
 log = logging.getLogger(__name__)
@@ -28,6 +29,7 @@ class Valorant(commands.Cog):
         self._updated = asyncio.Event()
         self._updated.set()
         self._last_update: Optional[datetime.datetime] = None
+        register_attribute('Valorant._shop_cache', self, '_shop_cache')
 
     async def cog_command_error(self, ctx, error) -> None:
         error = getattr(error, 'original', error)
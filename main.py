@@ -15,6 +15,7 @@ import asyncpg
 import discord
 from discord.ext import commands
 
+from utils.bus import InvalidationBus
 from utils.context import Context
 from config import BOT_TOKEN, DBURI
 
@@ -107,6 +108,7 @@ def get_prefix(bot: SnowflakeBot, message: discord.Message) -> List[str]:
 class SnowflakeBot(commands.Bot):
     user: discord.ClientUser
     pool: asyncpg.Pool
+    bus: InvalidationBus
     prefixes: dict[int, List[str]]
     session: aiohttp.ClientSession
     mb_client: mystbin.Client
@@ -124,11 +126,16 @@ class SnowflakeBot(commands.Bot):
 
     async def setup_hook(self) -> None:
         self.prefixes = await self.fetch_prefixes()
+        await self.bus.start()
 
         # This is might not be filled if bot.is_owner has not been called so we will fill it manually
         app_info = await self.application_info()
         self.owner_id = app_info.owner.id
 
+    async def close(self) -> None:
+        await self.bus.close()
+        await super().close()
+
     @property
     def owner(self) -> discord.User | None:
         return self.get_user(self.owner_id)
@@ -177,6 +184,7 @@ async def main() -> None:
 
     async with pool, SnowflakeBot() as bot, aiohttp.ClientSession() as session, LogHandler():
         bot.pool = pool
+        bot.bus = InvalidationBus(pool, DBURI)
         bot.session = session
         bot.mb_client = mystbin.Client(session=session)
 
@@ -0,0 +1,39 @@
+-- Schema changes on top of the bot's base tables, oldest first.
+-- Every statement can safely be run again, apply the whole file before deploying with:
+--     psql "$DBURI" -f migrations.sql
+
+BEGIN;
+
+-- Reminders are looked up by their author instead of by extra #>> '{args,0}' (cogs/reminder.py)
+ALTER TABLE timers ADD COLUMN IF NOT EXISTS author_id BIGINT;
+UPDATE timers SET author_id = (extra #>> '{args,0}')::bigint
+WHERE event = 'reminder' AND author_id IS NULL;
+CREATE INDEX IF NOT EXISTS timers_reminder_author_idx ON timers (author_id, expires)
+WHERE event = 'reminder';
+
+-- Due timers are leased to one of the processes dispatching them (cogs/reminder.py)
+-- lease_owner is the invalidation bus id of that process, NULL while nobody holds the timer
+ALTER TABLE timers ADD COLUMN IF NOT EXISTS lease_owner TEXT,
+                   ADD COLUMN IF NOT EXISTS lease_expires TIMESTAMPTZ;
+
+-- Highlight digests (cogs/highlight.py)
+-- The primary key on id is the conflict target of the 'highlight digest' upsert
+CREATE TABLE IF NOT EXISTS hl_digests (
+    id BIGINT PRIMARY KEY,
+    interval_minutes INTEGER NOT NULL,
+    last_sent TIMESTAMPTZ NOT NULL DEFAULT now()
+);
+-- Triggers waiting for their user's next digest, claimed and deleted by the digest loop
+CREATE TABLE IF NOT EXISTS hl_digest_pending (
+    id SERIAL PRIMARY KEY,
+    user_id BIGINT NOT NULL,
+    guild BIGINT NOT NULL,
+    channel BIGINT NOT NULL,
+    message BIGINT NOT NULL,
+    word TEXT,
+    content TEXT NOT NULL,
+    created TIMESTAMPTZ NOT NULL
+);
+CREATE INDEX IF NOT EXISTS hl_digest_pending_user_id_idx ON hl_digest_pending (user_id);
+
+COMMIT;
@@ -0,0 +1,180 @@
+from __future__ import annotations
+
+import asyncio
+import json
+import logging
+import uuid
+from collections import defaultdict
+from functools import partial
+from typing import Any, Awaitable, Callable, Optional, Union
+
+import asyncpg
+
+from utils.cache import CacheProtocol, apply_invalidation
+
+log = logging.getLogger(__name__)
+
+# Postgres refuses NOTIFY payloads of 8000 bytes or more
+MAX_PAYLOAD = 7999
+
+Subscriber = Callable[[Optional[Any]], Union[Awaitable[None], None]]
+
+
+class InvalidationBus:
+    """Tells the other bot processes sharing the database which in-memory state went stale
+
+    Every process LISTENs on one channel over a dedicated connection. publish sends
+    a topic and a small JSON payload to every other process, which hands it to the
+    callbacks subscribed to that topic. A process never receives its own messages.
+
+    Notifications sent while the connection is down are lost, so once it reconnects
+    every subscriber is called with None and should reload that state from the database.
+    """
+
+    CHANNEL = 'snowflake_invalidate'
+
+    def __init__(self, pool: asyncpg.Pool, dsn: str) -> None:
+        self.pool: asyncpg.Pool = pool
+        self.dsn: str = dsn
+        self.origin: str = uuid.uuid4().hex
+        self.sent: int = 0
+        self.received: int = 0
+        self._subscribers: defaultdict[str, list[Subscriber]] = defaultdict(list)
+        self._connection: Optional[asyncpg.Connection] = None
+        self._reconnect_task: Optional[asyncio.Task[None]] = None
+        self._closed: bool = False
+        self.subscribe('cache', self._on_cache_invalidation)
+
+    @property
+    def connected(self) -> bool:
+        return self._connection is not None and not self._connection.is_closed()
+
+    async def start(self) -> None:
+        self._closed = False
+        await self._connect()
+
+    async def close(self) -> None:
+        self._closed = True
+        if self._reconnect_task is not None:
+            self._reconnect_task.cancel()
+        if self._connection is not None:
+            connection, self._connection = self._connection, None
+            try:
+                await connection.close(timeout=5)
+            except Exception:
+                connection.terminate()
+
+    async def _connect(self) -> None:
+        connection = await asyncpg.connect(self.dsn)
+        await connection.add_listener(self.CHANNEL, self._on_notification)
+        connection.add_termination_listener(self._on_termination)
+        self._connection = connection
+        log.info('Listening for invalidations on %s as %s', self.CHANNEL, self.origin)
+
+    def _on_termination(self, connection: asyncpg.Connection) -> None:
+        if self._closed or connection is not self._connection:
+            return
+        log.warning('Invalidation bus connection lost, reconnecting')
+        self._connection = None
+        if self._reconnect_task is None or self._reconnect_task.done():
+            self._reconnect_task = asyncio.create_task(self._reconnect())
+
+    async def _reconnect(self) -> None:
+        delay = 1
+        while not self._closed:
+            try:
+                await self._connect()
+            except (OSError, asyncpg.PostgresError) as e:
+                log.warning('Reconnecting the invalidation bus failed (%s), retrying in %ss', e, delay)
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, 60)
+            else:
+                break
+        else:
+            return
+
+        # Anything published while we were gone is lost
+        for topic in list(self._subscribers):
+            self._dispatch(topic, None)
+
+    def subscribe(self, topic: str, callback: Subscriber) -> None:
+        """Call callback with the data of every message published to topic by another process
+
+        The callback may be a coroutine function, it is then run as its own task.
+        """
+        self._subscribers[topic].append(callback)
+
+    def unsubscribe(self, topic: str, callback: Subscriber) -> None:
+        try:
+            self._subscribers[topic].remove(callback)
+        except ValueError:
+            pass
+
+    async def publish(self, topic: str, data: Any = None, *, connection: Optional[asyncpg.Connection] = None) -> None:
+        """Send data to the subscribers of topic in every other process
+
+        Pass the connection of an open transaction to only deliver it once the transaction commits.
+        """
+        payload = json.dumps({'origin': self.origin, 'topic': topic, 'data': data}, separators=(',', ':'))
+        if len(payload.encode()) > MAX_PAYLOAD:
+            raise ValueError(f'Invalidation payload for {topic!r} is too large ({len(payload)} bytes)')
+
+        query = '''SELECT pg_notify($1, $2);'''
+        await (connection or self.pool).execute(query, self.CHANNEL, payload)
+        self.sent += 1
+
+    def _on_notification(self, connection: asyncpg.Connection, pid: int, channel: str, payload: str) -> None:
+        try:
+            message = json.loads(payload)
+            origin, topic, data = message['origin'], message['topic'], message['data']
+        except (ValueError, KeyError, TypeError):
+            log.warning('Ignoring malformed invalidation payload %r', payload)
+            return
+
+        if origin == self.origin:
+            return
+        self.received += 1
+        self._dispatch(topic, data)
+
+    def _dispatch(self, topic: str, data: Optional[Any]) -> None:
+        for callback in list(self._subscribers.get(topic, ())):
+            try:
+                result = callback(data)
+            except Exception:
+                log.exception('Invalidation subscriber %r for %r failed', callback, topic)
+                continue
+            if asyncio.iscoroutine(result):
+                task = asyncio.create_task(result)
+                task.add_done_callback(partial(self._log_failure, topic, callback))
+
+    @staticmethod
+    def _log_failure(topic: str, callback: Subscriber, task: asyncio.Task[None]) -> None:
+        if not task.cancelled() and task.exception() is not None:
+            log.error('Invalidation subscriber %r for %r failed', callback, topic, exc_info=task.exception())
+
+    # cache() decorated functions
+
+    def _on_cache_invalidation(self, data: Optional[dict[str, Any]]) -> None:
+        if data is None:
+            apply_invalidation(None, 'clear')
+        else:
+            apply_invalidation(data['name'], data['op'], data.get('value'))
+
+    async def invalidate_tag(self, func: CacheProtocol[Any], tag: Any) -> int:
+        """func.invalidate_tag(tag) here and in every other process"""
+        removed = func.invalidate_tag(tag)
+        await self.publish('cache', {'name': func.cache_name, 'op': 'tag', 'value': repr(tag)})
+        return removed
+
+    async def invalidate_containing(self, func: CacheProtocol[Any], key: str) -> int:
+        """func.invalidate_containing(key) here and in every other process"""
+        removed = func.invalidate_containing(key)
+        await self.publish('cache', {'name': func.cache_name, 'op': 'containing', 'value': key})
+        return removed
+
+    async def clear(self, func: CacheProtocol[Any]) -> int:
+        """func.clear() here and in every other process"""
+        removed = func.clear()
+        await self.publish('cache', {'name': func.cache_name, 'op': 'clear'})
+        return removed
+
@@ -8,25 +8,135 @@ This file was sourced from [RoboDanny](https://github.com/Rapptz/RoboDanny).
 
 from __future__ import annotations
 
+import sys
 import asyncio
 import enum
 import time
+import weakref
 
-from functools import wraps
-from typing import Any, Callable, Coroutine, MutableMapping, TypeVar, Protocol
+from collections import OrderedDict, deque
+from functools import wraps, partial
+from typing import Any, Callable, Coroutine, Hashable, MutableMapping, NamedTuple, Optional, TypeVar, Protocol
 
 from lru import LRU
 
 R = TypeVar('R')
 
+# Arguments of these types are used in tuple keys as they are, without a repr
+# bool and float are left out since True == 1 == 1.0 would share a key
+_PRIMITIVE_TYPES = frozenset({int, str, bytes, type(None)})
+
+
+class CacheStats(NamedTuple):
+    name: str
+    hits: Optional[int]
+    misses: Optional[int]
+    evictions: Optional[int]
+    entries: int
+    size: int  # approximate, in bytes
+
+
+# name: callable returning the stats, or None once the cache is gone
+_registry: dict[str, Callable[[], Optional[CacheStats]]] = {}
+
+# name: callable applying an invalidation (op, value) published by another process
+_invalidators: dict[str, Callable[[str, Any], int]] = {}
+
+
+def approximate_size(obj: Any, _seen: Optional[set[int]] = None) -> int:
+    """Rough deep size of the builtin containers in obj, other objects are only counted shallowly"""
+    seen = _seen if _seen is not None else set()
+    if id(obj) in seen:
+        return 0
+    seen.add(id(obj))
+
+    size = sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        size += sum(approximate_size(k, seen) + approximate_size(v, seen) for k, v in obj.items())
+    elif isinstance(obj, (list, tuple, set, frozenset, deque)):
+        size += sum(approximate_size(item, seen) for item in obj)
+    return size
+
+
+def register_cache(name: str, stats: Callable[[], Optional[CacheStats]]) -> None:
+    """Register a cache so it shows up in get_cache_stats, replacing any cache with the same name"""
+    _registry[name] = stats
+
+
+def register_attribute(
+    name: str,
+    owner: Any,
+    attribute: str,
+    *,
+    counters: Optional[Callable[[Any], tuple[int, int]]] = None,
+) -> None:
+    """Register a cache stored as an attribute, e.g. a dict on a cog.
+
+    The attribute is looked up every time so reassigning it is fine, and the
+    owner is only weakly referenced so the entry goes away with it.
+    counters can return (hits, misses) for the cache if it tracks them.
+    """
+    ref = weakref.ref(owner)
+
+    def stats() -> Optional[CacheStats]:
+        obj = ref()
+        if obj is None:
+            return None
+        value = getattr(obj, attribute)
+        hits, misses = counters(value) if counters is not None else (None, None)
+        try:
+            entries = len(value)
+        except TypeError:
+            entries = 0
+        # Look inside cache classes like MessageBuffer but never past them into arbitrary objects
+        size = approximate_size(value)
+        if not isinstance(value, (dict, list, tuple, set, frozenset, deque)) and hasattr(value, '__dict__'):
+            size += approximate_size(vars(value))
+        return CacheStats(name, hits, misses, getattr(value, 'evictions', None), entries, size)
+
+    register_cache(name, stats)
+
+
+def get_cache_stats() -> list[CacheStats]:
+    stats = []
+    for name, getter in list(_registry.items()):
+        result = getter()
+        if result is None:
+            del _registry[name]
+        else:
+            stats.append(result)
+    return sorted(stats, key=lambda s: s.name)
+
+
+def apply_invalidation(name: Optional[str], op: str, value: Any = None) -> int:
+    """Apply an invalidation received from another process, returns how many entries were removed
+
+    op is one of 'tag' (value is the repr of the argument), 'containing' or 'clear'.
+    A name of None applies it to every decorated cache.
+    """
+    if name is None:
+        return sum(invalidator(op, value) for invalidator in list(_invalidators.values()))
+    try:
+        invalidator = _invalidators[name]
+    except KeyError:
+        return 0
+    return invalidator(op, value)
+
+
+def export_cache_metrics() -> dict[str, dict[str, Optional[int]]]:
+    """JSON serialisable snapshot of every registered cache, for metrics collection"""
+    return {stat.name: stat._asdict() for stat in get_cache_stats()}
+
+
 # Can't use ParamSpec due to https://github.com/python/typing/discussions/946
 class CacheProtocol(Protocol[R]):
-    cache: MutableMapping[str, asyncio.Task[R]]
+    cache: MutableMapping[Hashable, asyncio.Task[R]]
+    cache_name: str
 
     def __call__(self, *args: Any, **kwds: Any) -> asyncio.Task[R]:
         ...
 
-    def get_key(self, *args: Any, **kwargs: Any) -> str:
+    def get_key(self, *args: Any, **kwargs: Any) -> Hashable:
         ...
 
     def invalidate(self, *args: Any, **kwargs: Any) -> bool:
@@ -35,21 +145,33 @@ class CacheProtocol(Protocol[R]):
     def invalidate_containing(self, key: str) -> None:
         ...
 
+    def invalidate_tag(self, tag: Any) -> int:
+        ...
+
+    def clear(self) -> int:
+        ...
+
     def get_stats(self) -> tuple[int, int]:
         ...
 
 
-class ExpiringCache(dict):
-    def __init__(self, seconds: float):
+class ExpiringCache(OrderedDict):
+    def __init__(self, seconds: float, maxsize: Optional[int] = None):
         self.__ttl: float = seconds
+        self.__maxsize: Optional[int] = maxsize
+        self.evictions: int = 0
         super().__init__()
 
     def __verify_cache_integrity(self):
-        # Have to do this in two steps...
+        # Every entry lives for the same ttl and is moved to the end when set,
+        # so the expired entries are always at the front
         current_time = time.monotonic()
-        to_remove = [k for (k, (v, t)) in super().items() if current_time > (t + self.__ttl)]
-        for k in to_remove:
-            del self[k]
+        while self:
+            _, t = super().__getitem__(next(iter(self)))
+            if current_time <= (t + self.__ttl):
+                break
+            self.popitem(last=False)
+            self.evictions += 1
 
     def __contains__(self, key: str):
         self.__verify_cache_integrity()
@@ -61,18 +183,27 @@ class ExpiringCache(dict):
         return v
 
     def get(self, key: str, default: Any = None):
+        self.__verify_cache_integrity()
         v = super().get(key, default)
         if v is default:
             return default
         return v[0]
 
     def __setitem__(self, key: str, value: Any):
+        self.__verify_cache_integrity()
         super().__setitem__(key, (value, time.monotonic()))
+        self.move_to_end(key)
+        if self.__maxsize is not None:
+            while len(self) > self.__maxsize:
+                self.popitem(last=False)
+                self.evictions += 1
 
     def values(self):
+        self.__verify_cache_integrity()
         return map(lambda x: x[0], super().values())
 
     def items(self):
+        self.__verify_cache_integrity()
         return map(lambda x: (x[0], x[1][0]), super().items())
 
 
@@ -86,26 +217,64 @@ def cache(
     maxsize: int = 128,
     strategy: Strategy = Strategy.lru,
     ignore_kwargs: bool = False,
+    *,
+    evict_failures: bool = True,
+    negative_ttl: Optional[float] = None,
+    refresh_after: Optional[float] = None,
+    tuple_keys: bool = False,
 ) -> Callable[[Callable[..., Coroutine[Any, Any, R]]], CacheProtocol[R]]:
+    """Cache the task of a coroutine function.
+
+    tuple_keys builds keys as tuples of the arguments instead of joined reprs, which is
+    much cheaper for hot calls with primitive arguments. Arguments without a custom
+    __repr__ (like self) are skipped, the string form is only built for invalidate_containing.
+
+    evict_failures drops tasks that raised or were cancelled instead of re-raising them forever.
+    negative_ttl keeps failures (if evicted at all) and None results for only this many seconds.
+    refresh_after serves entries older than this many seconds while a single background refresh runs.
+    """
+
     def decorator(func: Callable[..., Coroutine[Any, Any, R]]) -> CacheProtocol[R]:
+        # hits, misses, evictions other than the ones ExpiringCache counts itself
+        _counters = [0, 0, 0]
+
+        def _on_lru_evict(key: Hashable, value: asyncio.Task[R]) -> None:
+            _counters[2] += 1
+
         if strategy is Strategy.lru:
-            _internal_cache = LRU(maxsize)
-            _stats = _internal_cache.get_stats
+            _internal_cache = LRU(maxsize, callback=_on_lru_evict)
         elif strategy is Strategy.raw:
             _internal_cache = {}
-            _stats = lambda: (0, 0)
         elif strategy is Strategy.timed:
             _internal_cache = ExpiringCache(maxsize)
-            _stats = lambda: (0, 0)
 
-        def _make_key(args: tuple[Any, ...], kwargs: dict[str, Any]) -> str:
-            # this is a bit of a cluster fuck
-            # we do care what 'self' parameter is when we __repr__ it
-            def _true_repr(o):
-                if o.__class__.__repr__ is object.__repr__:
-                    return f'<{o.__class__.__module__}.{o.__class__.__name__}>'
-                return repr(o)
+        def _stats() -> tuple[int, int]:
+            return _counters[0], _counters[1]
+
+        def _full_stats() -> CacheStats:
+            evictions = _counters[2] + getattr(_internal_cache, 'evictions', 0)
+            size = approximate_size(list(_internal_cache.items())) + sys.getsizeof(_internal_cache)
+            return CacheStats(name, _counters[0], _counters[1], evictions, len(_internal_cache), size)
+
+        name = f'{func.__module__}.{func.__qualname__}'
+        register_cache(name, _full_stats)
+
+        # task: time.monotonic() it was cached at, only tracked when refreshing ahead
+        _created: weakref.WeakKeyDictionary[asyncio.Task[R], float] = weakref.WeakKeyDictionary()
+        _refreshing: set[Hashable] = set()
+
+        # tag (repr of an argument): {keys of the calls it was passed to}
+        _tag_index: dict[Any, set[Hashable]] = {}
+        _index_size = 0
+
+        # this is a bit of a cluster fuck
+        # we do care what 'self' parameter is when we __repr__ it
+        def _true_repr(o):
+            if o.__class__.__repr__ is object.__repr__:
+                return f'<{o.__class__.__module__}.{o.__class__.__name__}>'
+            return repr(o)
 
+        def _make_key(args: tuple[Any, ...], kwargs: dict[str, Any]) -> str:
             key = [f'{func.__module__}.{func.__name__}']
             key.extend(_true_repr(o) for o in args)
             if not ignore_kwargs:
@@ -122,41 +291,198 @@ def cache(
 
             return ':'.join(key)
 
+        def _make_tuple_key(args: tuple[Any, ...], kwargs: dict[str, Any]) -> tuple[Any, ...]:
+            key = []
+            for o in args:
+                if o.__class__ in _PRIMITIVE_TYPES:
+                    key.append(o)
+                elif o.__class__.__repr__ is not object.__repr__:
+                    key.append((o.__class__, repr(o)))
+            if not ignore_kwargs:
+                for k, v in kwargs.items():
+                    if k == 'connection' or k == 'pool':
+                        continue
+                    if v.__class__ in _PRIMITIVE_TYPES:
+                        key.append((k, v))
+                    elif v.__class__.__repr__ is not object.__repr__:
+                        key.append((k, (v.__class__, repr(v))))
+            return tuple(key)
+
+        def _tuple_key_to_str(key: tuple[Any, ...]) -> str:
+            parts = [f'{func.__module__}.{func.__name__}']
+            for o in key:
+                if o.__class__ is tuple and len(o) == 2 and isinstance(o[0], str):
+                    # keyword argument
+                    parts.append(repr(o[0]))
+                    o = o[1]
+                if o.__class__ is tuple:
+                    parts.append(o[1])
+                else:
+                    parts.append(repr(o))
+            return ':'.join(parts)
+
+        _key = _make_tuple_key if tuple_keys else _make_key
+
+        def _index_key(key: Hashable, args: tuple[Any, ...], kwargs: dict[str, Any]) -> None:
+            nonlocal _index_size
+            values = list(args)
+            if not ignore_kwargs:
+                values.extend(v for k, v in kwargs.items() if k not in ('connection', 'pool'))
+
+            for value in values:
+                # Objects without a useful repr (self, connections) would just tag every key
+                if value.__class__.__repr__ is object.__repr__:
+                    continue
+                _tag_index.setdefault(repr(value), set()).add(key)
+                _index_size += 1
+
+            # Evicted and expired keys are only dropped from the index here,
+            # rebuilding once it has grown well past the cache keeps this amortized O(1)
+            if _index_size > 2 * len(_internal_cache) + 128:
+                _index_size = 0
+                for tag in list(_tag_index):
+                    keys = {k for k in _tag_index[tag] if k in _internal_cache}
+                    if keys:
+                        _tag_index[tag] = keys
+                        _index_size += len(keys)
+                    else:
+                        del _tag_index[tag]
+
+        def _evict(key: Hashable, task: asyncio.Task[R]) -> None:
+            # Only if it has not been replaced or invalidated in the meantime
+            try:
+                if _internal_cache[key] is task:
+                    del _internal_cache[key]
+                    _counters[2] += 1
+            except KeyError:
+                pass
+
+        def _on_done(key: Hashable, task: asyncio.Task[R]) -> None:
+            if task.cancelled() or task.exception() is not None:
+                if not evict_failures:
+                    return
+            elif negative_ttl is None or task.result() is not None:
+                return
+
+            if negative_ttl:
+                asyncio.get_running_loop().call_later(negative_ttl, _evict, key, task)
+            else:
+                _evict(key, task)
+
+        def _store(key: Hashable, task: asyncio.Task[R]) -> None:
+            _internal_cache[key] = task
+            if refresh_after is not None:
+                _created[task] = time.monotonic()
+            task.add_done_callback(partial(_on_done, key))
+
+        def _on_refreshed(key: Hashable, stale: asyncio.Task[R], task: asyncio.Task[R]) -> None:
+            _refreshing.discard(key)
+            # A failed refresh keeps serving the stale value
+            if task.cancelled() or task.exception() is not None:
+                return
+            try:
+                if _internal_cache[key] is not stale:
+                    return
+            except KeyError:
+                return
+            _store(key, task)
+
+        def _maybe_refresh(key: Hashable, task: asyncio.Task[R], args: tuple[Any, ...], kwargs: dict[str, Any]) -> None:
+            if key in _refreshing or not task.done() or task.cancelled() or task.exception() is not None:
+                return
+            created = _created.get(task)
+            if created is None or time.monotonic() - created < refresh_after:
+                return
+            _refreshing.add(key)
+            refresh = asyncio.create_task(func(*args, **kwargs))
+            refresh.add_done_callback(partial(_on_refreshed, key, task))
+
         @wraps(func)
         def wrapper(*args: Any, **kwargs: Any):
-            key = _make_key(args, kwargs)
+            key = _key(args, kwargs)
             try:
                 task = _internal_cache[key]
             except KeyError:
-                _internal_cache[key] = task = asyncio.create_task(func(*args, **kwargs))
+                _counters[1] += 1
+                task = asyncio.create_task(func(*args, **kwargs))
+                _store(key, task)
+                _index_key(key, args, kwargs)
                 return task
             else:
+                _counters[0] += 1
+                if refresh_after is not None:
+                    _maybe_refresh(key, task, args, kwargs)
                 return task
 
         def _invalidate(*args: Any, **kwargs: Any) -> bool:
             try:
-                del _internal_cache[_make_key(args, kwargs)]
+                del _internal_cache[_key(args, kwargs)]
             except KeyError:
                 return False
             else:
                 return True
 
-        def _invalidate_containing(key: str) -> None:
+        def _invalidate_containing(key: str) -> int:
             to_remove = []
             for k in _internal_cache.keys():
-                if key in k:
+                if key in (_tuple_key_to_str(k) if tuple_keys else k):
                     to_remove.append(k)
+            removed = 0
             for k in to_remove:
                 try:
                     del _internal_cache[k]
                 except KeyError:
                     continue
+                else:
+                    removed += 1
+            return removed
+
+        def _invalidate_tag(tag: Any) -> int:
+            """Invalidate every cached call that was passed tag as an argument, returns how many were removed"""
+            return _drop_tag(_true_repr(tag))
+
+        def _drop_tag(tag: str) -> int:
+            nonlocal _index_size
+            keys = _tag_index.pop(tag, ())
+            _index_size -= len(keys)
+            removed = 0
+            for k in keys:
+                try:
+                    del _internal_cache[k]
+                except KeyError:
+                    continue
+                else:
+                    removed += 1
+            return removed
+
+        def _clear() -> int:
+            nonlocal _index_size
+            removed = len(_internal_cache)
+            _internal_cache.clear()
+            _tag_index.clear()
+            _refreshing.clear()
+            _index_size = 0
+            return removed
+
+        def _apply_invalidation(op: str, value: Any) -> int:
+            if op == 'tag':
+                return _drop_tag(value)
+            if op == 'containing':
+                return _invalidate_containing(value)
+            if op == 'clear':
+                return _clear()
+            raise ValueError(f'unknown invalidation {op!r}')
+
+        _invalidators[name] = _apply_invalidation
 
         wrapper.cache = _internal_cache
-        wrapper.get_key = lambda *args, **kwargs: _make_key(args, kwargs)
+        wrapper.cache_name = name
+        wrapper.get_key = lambda *args, **kwargs: _key(args, kwargs)
         wrapper.invalidate = _invalidate
         wrapper.get_stats = _stats
         wrapper.invalidate_containing = _invalidate_containing
+        wrapper.invalidate_tag = _invalidate_tag
+        wrapper.clear = _clear
         return wrapper  # type: ignore
 
     return decorator
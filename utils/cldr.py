@@ -0,0 +1,149 @@
+"""
+CLDR BCP 47 timezone names, compiled into a small JSON snapshot so loading them never waits on the network.
+
+Rebuild data/cldr_timezones.json with:
+    python -m utils.cldr [path/to/timezone.xml]
+which downloads timezone.xml from the CLDR repository when no file is given.
+"""
+
+from __future__ import annotations
+
+import datetime
+import json
+import logging
+import os
+import pathlib
+import sys
+import tempfile
+import urllib.request
+from typing import TYPE_CHECKING, NamedTuple, Optional
+
+from lxml import etree
+
+if TYPE_CHECKING:
+    import aiohttp
+
+log = logging.getLogger(__name__)
+
+CLDR_URL = 'https://raw.githubusercontent.com/unicode-org/cldr/main/common/bcp47/timezone.xml'
+SNAPSHOT_PATH = pathlib.Path(__file__).resolve().parent.parent / 'data' / 'cldr_timezones.json'
+SNAPSHOT_VERSION = 1
+
+
+class CLDRDataEntry(NamedTuple):
+    description: str
+    aliases: list[str]
+    deprecated: bool
+    preferred: Optional[str]
+
+
+class CLDRSnapshot(NamedTuple):
+    generated: datetime.datetime
+    # BCP 47 id: (description, IANA key)
+    timezones: dict[str, tuple[str, str]]
+
+    @property
+    def aliases(self) -> dict[str, str]:
+        return {description: key for description, key in self.timezones.values()}
+
+
+def parse_timezone_xml(data: bytes) -> dict[str, tuple[str, str]]:
+    """Resolve the entries of CLDR's timezone.xml to the IANA key to use for each one"""
+    parser = etree.XMLParser(ns_clean=True, recover=True, encoding='utf-8')
+    tree = etree.fromstring(data, parser=parser)
+
+    # Build a temporary dictionary to resolve "preferred" mappings
+    entries: dict[str, CLDRDataEntry] = {
+        node.attrib['name']: CLDRDataEntry(
+            description=node.attrib['description'],
+            aliases=node.get('alias', 'Etc/Unknown').split(' '),
+            deprecated=node.get('deprecated', 'false') == 'true',
+            preferred=node.get('preferred'),
+        )
+        for node in tree.iter('type')
+        # Filter the Etc/ entries (except UTC)
+        if not node.attrib['name'].startswith(('utcw', 'utce', 'unk'))
+        and not node.attrib['description'].startswith('POSIX')
+    }
+
+    timezones: dict[str, tuple[str, str]] = {}
+    for name, entry in entries.items():
+        # These use the first entry in the alias list as the "canonical" name to use when mapping the
+        # timezone to the IANA database.
+        # The CLDR database is not particularly correct when it comes to these, but neither is the IANA database.
+        # It turns out the notion of a "canonical" name is a bit of a mess. This works fine for users where
+        # this is only used for display purposes, but it's not ideal.
+        if entry.preferred is not None:
+            preferred = entries.get(entry.preferred)
+            if preferred is not None:
+                timezones[name] = (entry.description, preferred.aliases[0])
+        else:
+            timezones[name] = (entry.description, entry.aliases[0])
+    return timezones
+
+
+def load_snapshot(path: pathlib.Path = SNAPSHOT_PATH) -> Optional[CLDRSnapshot]:
+    """The snapshot at path, or None if it is missing or unreadable"""
+    try:
+        with open(path, encoding='utf-8') as fp:
+            data = json.load(fp)
+        if data['version'] != SNAPSHOT_VERSION:
+            raise ValueError(f'unsupported snapshot version {data["version"]}')
+        timezones = {name: (description, key) for name, (description, key) in data['timezones'].items()}
+        generated = datetime.datetime.fromisoformat(data['generated'])
+    except FileNotFoundError:
+        log.warning('No CLDR timezone snapshot at %s, run python -m utils.cldr to build it', path)
+        return None
+    except (OSError, ValueError, KeyError, TypeError) as e:
+        log.warning('Ignoring unreadable CLDR timezone snapshot at %s: %s', path, e)
+        return None
+    return CLDRSnapshot(generated, timezones)
+
+
+def write_snapshot(timezones: dict[str, tuple[str, str]], path: pathlib.Path = SNAPSHOT_PATH) -> CLDRSnapshot:
+    """Atomically replace the snapshot at path, readers see either the old or the new file"""
+    snapshot = CLDRSnapshot(datetime.datetime.now(datetime.UTC).replace(microsecond=0), timezones)
+    # One timezone per line keeps diffs of the committed snapshot readable
+    entries = ',\n'.join(
+        f'  {json.dumps(name)}: {json.dumps(list(value), ensure_ascii=False)}' for name, value in sorted(timezones.items())
+    )
+    header = f'"version": {SNAPSHOT_VERSION},\n"source": {json.dumps(CLDR_URL)},\n"generated": "{snapshot.generated.isoformat()}"'
+
+    path.parent.mkdir(parents=True, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=path.parent, prefix=f'.{path.name}.', suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'w', encoding='utf-8') as fp:
+            fp.write(f'{{\n{header},\n"timezones": {{\n{entries}\n}}\n}}\n')
+        os.replace(tmp, path)
+    except BaseException:
+        os.unlink(tmp)
+        raise
+    return snapshot
+
+
+async def fetch_timezones(session: aiohttp.ClientSession) -> Optional[dict[str, tuple[str, str]]]:
+    """Download and parse the current timezone.xml, None if CLDR answered with an error"""
+    async with session.get(CLDR_URL) as resp:
+        if resp.status != 200:
+            log.warning('Fetching CLDR timezone data failed with HTTP %s', resp.status)
+            return None
+        data = await resp.read()
+    return parse_timezone_xml(data)
+
+
+def main(argv: list[str]) -> None:
+    if argv:
+        data = pathlib.Path(argv[0]).read_bytes()
+    else:
+        with urllib.request.urlopen(CLDR_URL, timeout=30) as resp:
+            data = resp.read()
+
+    timezones = parse_timezone_xml(data)
+    if not timezones:
+        raise SystemExit('timezone.xml contained no timezones, refusing to write an empty snapshot')
+    write_snapshot(timezones)
+    print(f'Wrote {len(timezones)} timezones to {SNAPSHOT_PATH}')
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
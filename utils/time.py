@@ -10,13 +10,15 @@ from __future__ import annotations
 
 import re
 import datetime
-from typing import TYPE_CHECKING, Any, Optional, Union
+from typing import TYPE_CHECKING, Any, Callable, Optional, Union
 
 import parsedatetime as pdt
 from dateutil.relativedelta import relativedelta
 from discord.ext import commands
 from discord import app_commands
+from lru import LRU
 
+from utils.cache import CacheStats, approximate_size, register_cache
 from utils.formats import plural, human_join, format_dt as format_dt
 from utils.errors import TimezoneRequired
 
@@ -30,6 +32,240 @@ if TYPE_CHECKING:
     from utils.context import Context
     from cogs.timezone import Timezone
 
+# (naive local datetime, pdtContext, begin, end) of the first time found in an argument
+ParseResult = tuple[datetime.datetime, Any, int, int]
+
+
+class FastTimeParser:
+    """Parses the few shapes most reminders use without going through parsedatetime
+
+    "tomorrow", "[at] 5pm", "17:30", "tomorrow at 5pm", "[on|next] monday", "[in] N <unit>" and
+    "2024-12-31[ 17:30]" are handled, anything else returns None to fall back to parsedatetime.
+    Results are what parsedatetime gives for the same input, except that seconds, minutes and
+    hours are exact elapsed time where parsedatetime adds them to the wall clock across DST changes.
+    """
+
+    WEEKDAYS = ('monday', 'tuesday', 'wednesday', 'thursday', 'friday', 'saturday', 'sunday')
+    UNITS = {
+        'second': 'seconds', 'seconds': 'seconds', 'sec': 'seconds', 'secs': 'seconds',
+        'minute': 'minutes', 'minutes': 'minutes', 'min': 'minutes', 'mins': 'minutes',
+        'hour': 'hours', 'hours': 'hours', 'hr': 'hours',
+        'day': 'days', 'days': 'days',
+        'week': 'weeks', 'weeks': 'weeks',
+        'month': 'months', 'months': 'months',
+        'year': 'years', 'years': 'years',
+    }
+    ACCURACY = {
+        'seconds': pdt.pdtContext.ACU_SEC,
+        'minutes': pdt.pdtContext.ACU_MIN,
+        'hours': pdt.pdtContext.ACU_HOUR,
+        'days': pdt.pdtContext.ACU_DAY,
+        'weeks': pdt.pdtContext.ACU_WEEK,
+        'months': pdt.pdtContext.ACU_MONTH,
+        'years': pdt.pdtContext.ACU_YEAR,
+    }
+
+    _time = r"""(?:
+        (?P<hour>1[0-2]|0?[1-9])(?::(?P<minute>[0-5][0-9]))?\s*(?P<meridiem>am|pm)
+        |(?P<hour24>[01]?[0-9]|2[0-3]):(?P<minute24>[0-5][0-9])
+    )"""
+    tomorrow = re.compile(rf'tomorrow(?:\s+at\s+{_time})?', re.IGNORECASE | re.VERBOSE)
+    time_of_day = re.compile(rf'(?:at\s+)?{_time}', re.IGNORECASE | re.VERBOSE)
+    weekday = re.compile(rf'(?:(?P<next>next)\s+|on\s+)?(?P<weekday>{"|".join(WEEKDAYS)})', re.IGNORECASE)
+    offset = re.compile(rf'(?:in\s+)?(?P<amount>[0-9]{{1,4}}|an?)\s+(?P<unit>{"|".join(UNITS)})', re.IGNORECASE)
+    iso = re.compile(r'(?P<year>[0-9]{4})-(?P<month>[0-9]{2})-(?P<day>[0-9]{2})(?:\s+(?P<hour>[01][0-9]|2[0-3]):(?P<minute>[0-5][0-9]))?')
+
+    # parsedatetime may read these as part of the time when they follow a matched phrase
+    continuations = re.compile(
+        r"""[0-9]|(?:at|on|in|by|of|the|next|this|last|and|from|after|before|ago|later|today|tonight|tomorrow
+        |morning|afternoon|evening|night|noon|midnight|eod|eom|eoy|a\.?m|p\.?m|o'?clock
+        |jan|feb|mar|apr|may|jun|jul|aug|sep|oct|nov|dec|mon|tue|wed|thu|fri|sat|sun)""",
+        re.IGNORECASE | re.VERBOSE,
+    )
+
+    def __init__(self) -> None:
+        self.hits: int = 0
+        self.misses: int = 0
+        register_cache('utils.time.fast_path', self.get_stats)
+
+    @property
+    def hit_rate(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def get_stats(self) -> CacheStats:
+        return CacheStats('utils.time.fast_path', self.hits, self.misses, None, 0, 0)
+
+    def parse(self, argument: str, now: datetime.datetime, *, partial: bool = False) -> Optional[ParseResult]:
+        """Parse argument like calendar.parseDT, or like calendar.nlp for a time at the start of it if partial"""
+        for shape in (self._tomorrow, self._time_of_day, self._weekday, self._offset, self._iso):
+            try:
+                result = shape(argument, now, partial)
+            except (ValueError, OverflowError):
+                result = None
+            if result is not None:
+                self.hits += 1
+                return result
+        self.misses += 1
+        return None
+
+    def _match(self, regex: re.Pattern[str], argument: str, partial: bool) -> Optional[re.Match[str]]:
+        if not partial:
+            return regex.fullmatch(argument.strip())
+
+        match = regex.match(argument)
+        if match is None:
+            return None
+        rest = argument[match.end():]
+        if rest and rest[0] not in ' ,.!':
+            return None
+        if self.continuations.match(rest.lstrip(' ,.!')):
+            return None
+        return match
+
+    @staticmethod
+    def _clock(match: re.Match[str]) -> Optional[tuple[int, int, int]]:
+        """hour, minute and accuracy of the time in a match, if it has one"""
+        if match.group('hour24') is not None:
+            return int(match.group('hour24')), int(match.group('minute24')), pdt.pdtContext.ACU_HOUR | pdt.pdtContext.ACU_MIN
+        if match.group('hour') is None:
+            return None
+        hour = int(match.group('hour')) % 12
+        if match.group('meridiem').lower() == 'pm':
+            hour += 12
+        if match.group('minute') is not None:
+            return hour, int(match.group('minute')), pdt.pdtContext.ACU_HOUR | pdt.pdtContext.ACU_MIN
+        return hour, 0, pdt.pdtContext.ACU_HOUR
+
+    @staticmethod
+    def _local(now: datetime.datetime) -> datetime.datetime:
+        return now.replace(microsecond=0, tzinfo=None)
+
+    def _tomorrow(self, argument: str, now: datetime.datetime, partial: bool) -> Optional[ParseResult]:
+        match = self._match(self.tomorrow, argument, partial)
+        if match is None:
+            return None
+        dt = self._local(now) + datetime.timedelta(days=1)
+        clock = self._clock(match)
+        if clock is None:
+            return dt.replace(hour=9, minute=0, second=0), pdt.pdtContext(pdt.pdtContext.ACU_DAY), 0, match.end()
+        hour, minute, accuracy = clock
+        dt = dt.replace(hour=hour, minute=minute, second=0)
+        return dt, pdt.pdtContext(pdt.pdtContext.ACU_DAY | accuracy), 0, match.end()
+
+    def _time_of_day(self, argument: str, now: datetime.datetime, partial: bool) -> Optional[ParseResult]:
+        match = self._match(self.time_of_day, argument, partial)
+        if match is None:
+            return None
+        hour, minute, accuracy = self._clock(match)  # type: ignore  # always has a time
+        dt = self._local(now).replace(hour=hour, minute=minute, second=0)
+        return dt, pdt.pdtContext(accuracy), 0, match.end()
+
+    def _weekday(self, argument: str, now: datetime.datetime, partial: bool) -> Optional[ParseResult]:
+        match = self._match(self.weekday, argument, partial)
+        if match is None:
+            return None
+        target = self.WEEKDAYS.index(match.group('weekday').lower())
+        dt = self._local(now)
+        if match.group('next'):
+            # parsedatetime reads "next monday" as the monday of next week
+            dt += datetime.timedelta(days=7 - dt.weekday() + target)
+            dt = dt.replace(hour=9, minute=0, second=0)
+        else:
+            dt += datetime.timedelta(days=(target - dt.weekday() - 1) % 7 + 1)
+        return dt, pdt.pdtContext(pdt.pdtContext.ACU_DAY), 0, match.end()
+
+    def _offset(self, argument: str, now: datetime.datetime, partial: bool) -> Optional[ParseResult]:
+        match = self._match(self.offset, argument, partial)
+        if match is None:
+            return None
+        amount = match.group('amount').lower()
+        unit = self.UNITS[match.group('unit').lower()]
+        value = 1 if amount in ('a', 'an') else int(amount)
+
+        if unit in ('seconds', 'minutes', 'hours') and now.tzinfo is not None:
+            delta = datetime.timedelta(**{unit: value})
+            dt = self._local((now.astimezone(datetime.timezone.utc) + delta).astimezone(now.tzinfo))
+        else:
+            dt = self._local(now) + relativedelta(**{unit: value})
+        return dt, pdt.pdtContext(self.ACCURACY[unit]), 0, match.end()
+
+    def _iso(self, argument: str, now: datetime.datetime, partial: bool) -> Optional[ParseResult]:
+        match = self._match(self.iso, argument, partial)
+        if match is None:
+            return None
+        accuracy = pdt.pdtContext.ACU_YEAR | pdt.pdtContext.ACU_MONTH | pdt.pdtContext.ACU_DAY
+        dt = self._local(now).replace(year=int(match.group('year')), month=int(match.group('month')), day=int(match.group('day')))
+        if match.group('hour') is not None:
+            dt = dt.replace(hour=int(match.group('hour')), minute=int(match.group('minute')), second=0)
+            accuracy |= pdt.pdtContext.ACU_HOUR | pdt.pdtContext.ACU_MIN
+        return dt, pdt.pdtContext(accuracy), 0, match.end()
+
+
+class ParseCache:
+    """Memoizes parsedatetime results, which are slow to compute
+
+    Entries are kept per argument, timezone and local date. On a miss the argument is parsed
+    a second time against a source time 6 hours apart on the same date, if both results are
+    the same the phrase is absolute (e.g. "5pm", "tomorrow") and the result is reused as is.
+    If they moved along with the source time it is relative (e.g. "in 3 days") and only the
+    offset is kept, to be added to the source time of later calls. Anything else isn't cached.
+    """
+
+    PROBE = datetime.timedelta(hours=6)
+
+    def __init__(self, maxsize: int = 2048) -> None:
+        # (kind, argument, timezone, local date): (is relative, datetime or offset, pdtContext, begin, end)
+        # or None if nothing was found
+        self.entries: LRU = LRU(maxsize)
+        self.hits: int = 0
+        self.misses: int = 0
+        register_cache('utils.time.parse_cache', self.get_stats)
+
+    def get_stats(self) -> CacheStats:
+        size = approximate_size(list(self.entries.items()))
+        return CacheStats('utils.time.parse_cache', self.hits, self.misses, None, len(self.entries), size)
+
+    def parse(
+        self,
+        kind: str,
+        argument: str,
+        now: datetime.datetime,
+        parser: Callable[[str, datetime.datetime], Optional[ParseResult]],
+    ) -> Optional[ParseResult]:
+        # parsedatetime works on the local wall time and drops microseconds
+        source = now.replace(microsecond=0, tzinfo=None)
+        key = (kind, argument, str(now.tzinfo), source.date())
+        try:
+            entry = self.entries[key]
+        except KeyError:
+            pass
+        else:
+            self.hits += 1
+            if entry is None:
+                return None
+            relative, value, status, begin, end = entry
+            return (source + value if relative else value), status, begin, end
+
+        self.misses += 1
+        result = parser(argument, now)
+        probe_now = now - self.PROBE if now.hour >= 12 else now + self.PROBE
+        probe = parser(argument, probe_now)
+
+        if result is None or probe is None:
+            if result is None and probe is None:
+                self.entries[key] = None
+            return result
+
+        dt, status, begin, end = result
+        if (begin, end) != (probe[2], probe[3]):
+            return result
+        if probe[0] == dt:
+            self.entries[key] = (False, dt, status, begin, end)
+        elif probe[0] - probe_now.replace(microsecond=0, tzinfo=None) == dt - source:
+            self.entries[key] = (True, dt - source, status, begin, end)
+        return result
+
 
 class ShortTime:
     compiled = re.compile(
@@ -107,6 +343,21 @@ class RelativeDelta(app_commands.Transformer, commands.Converter):
 
 class HumanTime:
     calendar = pdt.Calendar(version=pdt.VERSION_CONTEXT_STYLE)
+    parse_cache = ParseCache()
+    fast_path = FastTimeParser()
+
+    @classmethod
+    def _parse_dt(cls, argument: str, now: datetime.datetime) -> ParseResult:
+        dt, status = cls.calendar.parseDT(argument, sourceTime=now, tzinfo=None)
+        return dt, status, 0, len(argument)
+
+    @classmethod
+    def _nlp(cls, argument: str, now: datetime.datetime) -> Optional[ParseResult]:
+        elements = cls.calendar.nlp(argument, sourceTime=now)
+        if elements is None or len(elements) == 0:
+            return None
+        dt, status, begin, end, _ = elements[0]
+        return dt, status, begin, end
 
     def __init__(
         self,
@@ -116,7 +367,8 @@ class HumanTime:
         tzinfo: datetime.tzinfo = datetime.timezone.utc,
     ):
         now = now or datetime.datetime.now(tzinfo)
-        dt, status = self.calendar.parseDT(argument, sourceTime=now, tzinfo=None)
+        parsed = self.fast_path.parse(argument, now) or self.parse_cache.parse('dt', argument, now, self._parse_dt)
+        dt, status, _, _ = parsed  # type: ignore  # never None
         if not status.hasDateOrTime:
             raise commands.BadArgument('invalid time provided, try e.g. "tomorrow" or "3 days"')
 
@@ -241,7 +493,6 @@ class UserFriendlyTime(commands.Converter):
         self.default: Any = default
 
     async def convert(self, ctx: Context, argument: str) -> FriendlyTimeResult:
-        calendar = HumanTime.calendar
         regex = ShortTime.compiled
         now = ctx.message.created_at
 
@@ -284,8 +535,10 @@ class UserFriendlyTime(commands.Converter):
 
         # Have to adjust the timezone so pdt knows how to handle things like "tomorrow at 6pm" in an aware way
         now = now.astimezone(tzinfo)
-        elements = calendar.nlp(argument, sourceTime=now)
-        if elements is None or len(elements) == 0:
+        parsed = HumanTime.fast_path.parse(argument, now, partial=True) or HumanTime.parse_cache.parse(
+            'nlp', argument, now, HumanTime._nlp
+        )
+        if parsed is None:
             raise commands.BadArgument('Invalid time provided, try e.g. "tomorrow" or "3 days".')
 
         # handle the following cases:
@@ -294,7 +547,7 @@ class UserFriendlyTime(commands.Converter):
         # foo date time
 
         # first the first two cases:
-        dt, status, begin, end, dt_string = elements[0]
+        dt, status, begin, end = parsed
 
         if not status.hasDateOrTime:
             raise commands.BadArgument('Invalid time provided, try e.g. "tomorrow" or "3 days".')